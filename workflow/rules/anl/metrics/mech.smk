@@ -34,9 +34,10 @@ rule mech_prt:
         python workflow/scripts/anl/metrics/mech/prt.py \
         -i {input.grn} \
         -b {input.rsc} \
-        -o {output.out}
-        if [ $? -eq 124 ]; then
-            awk 'BEGIN {{ print "name,prc,rcl,f01" }}' > {output.out}
+        -o {output.out} \
+        -n {threads}
+        if [ $? -eq 124 ] && [ ! -s {output.out} ]; then
+            awk 'BEGIN {{ print "name,prc,rcl,f01,status"; print "{wildcards.pre}.{wildcards.p2g}.{wildcards.tfb}.{wildcards.mdl},,,,timeout" }}' > {output.out}
         fi
         """
 
@@ -45,7 +46,7 @@ rule extract_mech_tfm:
     threads: 1
     singularity: 'workflow/envs/gretabench.sif'
     input:
-        mdata=rules.extract_case.output.mdata,
+        mdata=dense_mdata,
         tf=rules.gen_tfs_lambert.output,
     output: 'anl/metrics/mech/sss/sss/{dat}.{case}/tfm.csv'
     shell:
@@ -64,6 +65,7 @@ rule mech_sss:
         out='anl/metrics/mech/sss/sss/{dat}.{case}/{pre}.{p2g}.{tfb}.{mdl}.scores.csv'
     params:
         thr_pval=0.01,
+        max_states=100000,
     resources:
         mem_mb=8000,
         runtime=60,
@@ -71,9 +73,15 @@ rule mech_sss:
         """
         set +e
         timeout $(({resources.runtime}-20))m \
-    	python workflow/scripts/anl/metrics/mech/sim.py {input.grn} {input.tfm} {params.thr_pval} {output.out}
+    	python workflow/scripts/anl/metrics/mech/sim.py \
+        -i {input.grn} \
+        -t {input.tfm} \
+        -p {params.thr_pval} \
+        -s {params.max_states} \
+        -m $((({resources.runtime}-25)*60)) \
+        -o {output.out}
         if [ $? -eq 124 ]; then
-            awk 'BEGIN {{ print "name,prc,rcl,f01" }}' > {output.out}
+            awk 'BEGIN {{ print "name,prc,rcl,f01,partial,status"; print "{wildcards.pre}.{wildcards.p2g}.{wildcards.tfb}.{wildcards.mdl},,,,,timeout" }}' > {output.out}
         fi
     	"""
 
@@ -1,5 +1,5 @@
 rule pred_omics:
-    threads: 1
+    threads: 4
     singularity: 'workflow/envs/gretabench.sif'
     input:
         grn=lambda w: rules.grn_run.output.out.format(**w),
@@ -18,6 +18,7 @@ rule pred_omics:
         -c {params.col_target} \
         -d {params.mod_source} \
         -e {params.mod_target} \
+        -n {threads} \
         -f {output}
         """
 
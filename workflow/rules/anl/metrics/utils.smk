@@ -1,10 +1,17 @@
 localrules: aggr_metric, metric_summ
 
 
+def metric_scores(w):
+    """Per grn score csvs, or the scores db of a single batch job if metric_batch is set"""
+    if config.get('metric_batch', False):
+        return rules.metric_batch.output.out.format(**w)
+    return make_combs_rules(w=w, mthds=mthds, baselines=baselines, rule_name='{typ}_{tsk}'.format(typ=w.type, tsk=w.task))
+
+
 rule aggr_metric:
     threads: 1
     input:
-        lambda w: make_combs_rules(w=w, mthds=mthds, baselines=baselines, rule_name='{typ}_{tsk}'.format(typ=w.type, tsk=w.task))
+        metric_scores
     output:
         'anl/metrics/{type}/{task}/{db}/{dat}.{case}.scores.csv'
     shell:
@@ -16,7 +23,7 @@ rule aggr_metric:
 
 
 rule metric_summ:
-    threads: 1
+    threads: 4
     singularity: 'workflow/envs/gretabench.sif'
     input:
         [
@@ -48,5 +55,87 @@ rule metric_summ:
     output: 'anl/metrics/summary/{dat}.{case}.csv'
     shell:
         """
-        python workflow/scripts/anl/metrics/test.py -m {input} -o {output}
+        python workflow/scripts/anl/metrics/test.py -m {input} -n {threads} -o {output}
+        """
+
+
+# threads are grn workers, grn_mins the time limit of each grn (None for no limit)
+batch_metrics = {
+    ('prior', 'tfm'): dict(script='prior/tfm', rsc='dbs/hg38/tfm/{db}/{db}.tsv', params=['resource_path={rsc}'], threads=4, grn_mins=None),
+    ('prior', 'tfp'): dict(script='prior/tfp', rsc='dbs/hg38/tfp/{db}/{db}.tsv', params=['resource_path={rsc}', 'thr_p=0.01'], threads=4, grn_mins=None),
+    ('prior', 'tfb'): dict(script='prior/gnm', rsc='dbs/hg38/tfb/{db}/{db}.bed', params=['resource_path={rsc}', 'grp=source'], threads=4, grn_mins=None),
+    ('prior', 'cre'): dict(script='prior/gnm', rsc='dbs/hg38/cre/{db}/{db}.bed', params=['resource_path={rsc}'], threads=4, grn_mins=None),
+    ('prior', 'c2g'): dict(script='prior/gnm', rsc='dbs/hg38/c2g/{db}/{db}.bed', params=['resource_path={rsc}', 'grp=target'], threads=4, grn_mins=None),
+    ('pred', 'omics'): dict(script='pred/omics', rsc=None, params=[], threads=4, grn_mins=None),
+    ('pred', 'gsets'): dict(script='pred/gsets', rsc='dbs/hg38/gst/{db}.csv', params=['ptw_path={rsc}'], threads=4, grn_mins=None),
+    ('mech', 'tfa'): dict(script='mech/tfa', rsc='dbs/hg38/prt/{db}', params=['bnc_path={rsc}'], threads=4, grn_mins=None),
+    ('mech', 'prt'): dict(script='mech/prt', rsc='dbs/hg38/prt/{db}', params=['bnc_path={rsc}'], threads=16, grn_mins=config['max_mins_per_step'] * 2 - 20),
+    ('mech', 'sss'): dict(script='mech/sim', rsc='anl/metrics/mech/sss/sss/{dat}.{case}/tfm.csv', params=['path_tfs={rsc}', 'thr_pval=0.01', 'max_states=100000', 'max_time={max_time}'], threads=4, grn_mins=40),
+}
+
+
+def batch_rsc(w):
+    rsc = batch_metrics[(w.type, w.task)]['rsc']
+    return [] if rsc is None else rsc.format(**w)
+
+
+def batch_grns(w):
+    return make_combs_rules(w=w, mthds=mthds, baselines=baselines, rule_name='grn_run')
+
+
+def batch_grn_secs(w):
+    grn_mins = batch_metrics[(w.type, w.task)]['grn_mins']
+    return 0 if grn_mins is None else grn_mins * 60
+
+
+def batch_runtime(w):
+    """Worst case runtime in minutes, every grn of each worker reaching its limit"""
+    mtr = batch_metrics[(w.type, w.task)]
+    if mtr['grn_mins'] is None:
+        return config['max_mins_per_step']
+    n_rounds = -(-len(batch_grns(w)) // mtr['threads'])
+    return n_rounds * mtr['grn_mins'] + 20
+
+
+def batch_params(w):
+    mtr = batch_metrics[(w.type, w.task)]
+    # Stop the steady state search 5 mins before the grn time limit
+    max_time = max(batch_grn_secs(w) - 300, 0)
+    params = [p.format(rsc=batch_rsc(w), max_time=max_time) for p in mtr['params']]
+    if (w.type, w.task) == ('pred', 'omics'):
+        params += [
+            'col_source={0}'.format('cre' if w.db == 'gcre' else 'source'),
+            'col_target={0}'.format('cre' if w.db == 'cretf' else 'target'),
+            'mod_source={0}'.format('atac' if w.db == 'gcre' else 'rna'),
+            'mod_target={0}'.format('atac' if w.db == 'cretf' else 'rna'),
+        ]
+    return ' '.join(params)
+
+
+rule metric_batch:
+    threads: lambda w: batch_metrics[(w.type, w.task)]['threads']
+    singularity: 'workflow/envs/gretabench.sif'
+    input:
+        grns=batch_grns,
+        rsc=batch_rsc,
+    output:
+        out='anl/metrics/{type}/{task}/{db}/{dat}.{case}.scores.db',
+        tlm='anl/metrics/{type}/{task}/{db}/{dat}.{case}.telemetry.jsonl',
+    params:
+        script=lambda w: batch_metrics[(w.type, w.task)]['script'],
+        params=batch_params,
+        grn_secs=batch_grn_secs,
+    resources:
+        mem_mb=restart_mem,
+        runtime=batch_runtime,
+    shell:
+        """
+        python workflow/scripts/anl/metrics/run_batch.py \
+        -m {params.script} \
+        -i {input.grns} \
+        -p {params.params} \
+        -t {params.grn_secs} \
+        -n {threads} \
+        -l {output.tlm} \
+        -o {output.out}
         """
@@ -1,11 +1,15 @@
 localrules: run_stab, stab_ovsd, stab_cor, stab_unsmthds
 
+# Downsampling lattice of the stability cases, shared with stab_lattice
+stab_ns = [1024, 2048, 4096, 8192, 16384]
+stab_seeds = [0, 1, 2]
+
 def get_stab_paths(config, mthds, baselines, datasets):
     if not datasets:  # Return empty lists if datasets is empty
         return [], [], []
     
-    ns = [1024, 2048, 4096, 8192, 16384]
-    seeds = [0, 1, 2]
+    ns = stab_ns
+    seeds = stab_seeds
     mthds = ['o_' + m for m in mthds]
     mthds.extend(baselines)
     d_lst = []
@@ -23,6 +27,7 @@ def get_stab_paths(config, mthds, baselines, datasets):
                 config['dts'][dataset]['cases'][case]['seed'] = seed
                 config['dts'][dataset]['cases'][case]['n_hvg'] = n_gene
                 config['dts'][dataset]['cases'][case]['n_hvr'] = n_cre
+                config['dts'][dataset]['cases'][case]['lattice'] = True
                 for mth in mthds:
                     d_lst.append(dataset)
                     c_lst.append(case)
@@ -38,6 +43,7 @@ def get_stab_paths(config, mthds, baselines, datasets):
                 config['dts'][dataset]['cases'][case]['seed'] = seed
                 config['dts'][dataset]['cases'][case]['n_hvg'] = n_gene
                 config['dts'][dataset]['cases'][case]['n_hvr'] = n_cre
+                config['dts'][dataset]['cases'][case]['lattice'] = True
                 for mth in mthds:
                     d_lst.append(dataset)
                     c_lst.append(case)
@@ -49,25 +55,41 @@ d_lst, c_lst, m_lst = get_stab_paths(config, mthds, baselines, stab_datasets)
 
 # Only define stability analysis rules if stab_datasets is not empty
 if stab_datasets:
+    rule stab_lattice:
+        threads: 32
+        singularity: 'workflow/envs/gretabench.sif'
+        input: lambda w: map_rules('annotate', w.dat)
+        output:
+            base='dts/{dat}/lattice/base.h5mu',
+            idx='dts/{dat}/lattice/idx.npz',
+        params:
+            n_sample=stab_ns[-1],
+            seeds=';'.join(map(str, stab_seeds)),
+        shell:
+            """
+            python workflow/scripts/dts/extract_lattice.py \
+            -i '{input}' \
+            -s '{params.n_sample}' \
+            -d '{params.seeds}' \
+            -o '{output.base}' \
+            -x '{output.idx}'
+            """
+
+
     rule run_stab:
         threads: 1
         container: None
         input:
-            expand(['dts/{dat}/cases/{case}/runs/{mth}.{mth}.{mth}.{mth}.grn.csv'], zip, dat=d_lst, case=c_lst, mth=m_lst)
+            grns=expand(['dts/{dat}/cases/{case}/runs/{mth}.{mth}.{mth}.{mth}.grn.csv'], zip, dat=d_lst, case=c_lst, mth=m_lst),
         output:
             res='anl/stab/{dat}.ovc.csv',
             auc='anl/stab/{dat}.auc.csv',
         shell:
             """
-            last_date=$(stat -c %y {input[0]} | cut -d ' ' -f 1)
-            last_date=$(date -d "$last_date - 2 days" +%Y-%m-%d)
-            sacct -S $last_date -E $(date -d '23:59:59 today' +%Y-%m-%dT%H:%M:%S) --state=COMPLETED --format=Jobname%100,elapsed,MaxRss,State | \
-            awk '/^ +mdl_/ {{jobname=$1; getline; if ($1 == "batch") print jobname, $2, $3}}' > {output.res}.tmp &&
             python workflow/scripts/anl/stab/run_stab.py \
-            -i {output.res}.tmp \
+            -i {input.grns} \
             -r {output.res} \
-            -a {output.auc} &&
-            rm {output.res}.tmp
+            -a {output.auc}
             """
     
     
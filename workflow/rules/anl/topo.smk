@@ -11,11 +11,17 @@ rule topo_mult:
         sims='anl/topo/{dat}.{case}.sims_mult.csv',
     resources:
         mem_mb=128000
+    params:
+        max_edges=config.get('topo_max_edges', 0),
+        n_pivots=config.get('topo_n_pivots', 256),
     shell:
         """
         python workflow/scripts/anl/topo/run_pair_sim.py \
         -t {output.stats} \
-        -s {output.sims}
+        -s {output.sims} \
+        -n {threads} \
+        -b {params.max_edges} \
+        -p {params.n_pivots}
         """
 
 
@@ -1,7 +1,14 @@
+def case_input(w):
+    """Full annotated object, or the lattice base for cases derived from it (stability cases)"""
+    if config['dts'][w.dat]['cases'][w.case].get('lattice', False):
+        return ['dts/{dat}/lattice/base.h5mu'.format(**w), 'dts/{dat}/lattice/idx.npz'.format(**w)]
+    return [map_rules('annotate', w.dat)]
+
+
 rule extract_case:
     threads: 32
     singularity: 'workflow/envs/gretabench.sif'
-    input: lambda w: map_rules('annotate', w.dat)
+    input: case_input
     output:
         mdata='dts/{dat}/cases/{case}/mdata.h5mu',
     params:
@@ -11,15 +18,41 @@ rule extract_case:
         n_hvg=lambda w: config['dts'][w.dat]['cases'][w.case]['n_hvg'],
         n_hvr=lambda w: config['dts'][w.dat]['cases'][w.case]['n_hvr'],
         root=lambda w: config['dts'][w.dat]['cases'][w.case]['root'] if 'root' in config['dts'][w.dat]['cases'][w.case] else 'None',
+        sparse=lambda w: config['dts'][w.dat]['cases'][w.case].get('sparse', False),
+        chunk_size=lambda w: config['dts'][w.dat]['cases'][w.case].get('chunk_size', 0),
+        lattice=lambda w: case_input(w)[1] if len(case_input(w)) > 1 else 'None',
     shell:
         """
         python workflow/scripts/dts/extract_case.py \
-        -i '{input}' \
+        -i '{input[0]}' \
         -c '{params.celltypes}' \
         -s '{params.n_sample}' \
         -d '{params.seed}' \
         -g '{params.n_hvg}' \
         -r '{params.n_hvr}' \
         -t '{params.root}' \
+        -x '{params.sparse}' \
+        -k '{params.chunk_size}' \
+        -l '{params.lattice}' \
         -o '{output.mdata}'
         """
+
+
+rule densify_case:
+    threads: 1
+    singularity: 'workflow/envs/gretabench.sif'
+    input: rules.extract_case.output.mdata
+    output: 'dts/{dat}/cases/{case}/mdata.dense.h5mu'
+    shell:
+        """
+        python workflow/scripts/dts/densify_case.py \
+        -i '{input}' \
+        -o '{output}'
+        """
+
+
+def dense_mdata(w):
+    """Case mdata for methods that need a dense X, densified only for sparse cases"""
+    if config['dts'][w.dat]['cases'][w.case].get('sparse', False):
+        return rules.densify_case.output[0].format(**w)
+    return rules.extract_case.output.mdata.format(**w)
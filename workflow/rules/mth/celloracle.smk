@@ -3,7 +3,7 @@ rule pre_celloracle:
     singularity: 'workflow/envs/celloracle.sif'
     input:
         img='workflow/envs/celloracle.sif',
-        mdata=rules.extract_case.output.mdata
+        mdata=dense_mdata
     output:
         out='dts/{dat}/cases/{case}/runs/celloracle.pre.h5mu'
     params:
@@ -103,6 +103,7 @@ rule mdl_celloracle:
         tfb=lambda wildcards: map_rules('tfb', wildcards.tfb),
     output:
         out='dts/{dat}/cases/{case}/runs/{pre}.{p2g}.{tfb}.celloracle.mdl.csv'
+    benchmark: 'dts/{dat}/cases/{case}/runs/{pre}.{p2g}.{tfb}.celloracle.bench.tsv'
     params:
         a=config['methods']['celloracle']['a'],
         p=config['methods']['celloracle']['p'],
@@ -135,12 +136,13 @@ rule mdl_o_celloracle:
     threads: 32
     singularity: 'workflow/envs/celloracle.sif'
     input:
-        mdata=rules.extract_case.output.mdata,
+        mdata=dense_mdata,
         csz=rules.gen_genome_celloracle.output,
     output:
         pp=temp(local('dts/{dat}/cases/{case}/runs/celloracle.src.peaks.csv')),
         pc=temp(local('dts/{dat}/cases/{case}/runs/celloracle.src.conns.csv')),
         out='dts/{dat}/cases/{case}/runs/o_celloracle.o_celloracle.o_celloracle.o_celloracle.mdl.csv',
+    benchmark: 'dts/{dat}/cases/{case}/runs/o_celloracle.o_celloracle.o_celloracle.o_celloracle.bench.tsv'
     params:
         organism=lambda w: config['dts'][w.dat]['organism'],
         k=config['methods']['celloracle']['k'],
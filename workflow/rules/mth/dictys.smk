@@ -6,7 +6,7 @@ rule pre_dictys:
     conda: '{home_path}/miniforge3/envs/dictys'.format(home_path=home_path)
     input:
         img=rules.install_dictys.output,
-        mdata=rules.extract_case.output.mdata
+        mdata=dense_mdata
     output:
         tmp='dts/{dat}/cases/{case}/runs/dictys_pre_expr.tsv.gz',
         out='dts/{dat}/cases/{case}/runs/dictys.pre.h5mu',
@@ -103,6 +103,7 @@ rule mdl_dictys:
     output:
         d=temp(directory('dts/{dat}/cases/{case}/runs/{pre}.{p2g}.{tfb}.dictys_tmp')),
         out='dts/{dat}/cases/{case}/runs/{pre}.{p2g}.{tfb}.dictys.mdl.csv'
+    benchmark: 'dts/{dat}/cases/{case}/runs/{pre}.{p2g}.{tfb}.dictys.bench.tsv'
     params:
         ext=config['methods']['dictys']['ext'] // 2,
         n_p2g_links=config['methods']['dictys']['n_p2g_links'],
@@ -142,7 +143,7 @@ rule mdl_o_dictys:
     conda: '{home_path}/miniforge3/envs/dictys'.format(home_path=home_path)
     container: None
     input:
-        mdata=rules.extract_case.output.mdata,
+        mdata=dense_mdata,
         ann=rules.gen_ann_dictys.output,
         frags=list_frags_files,
         motif=rules.gen_motif_dictys.output,
@@ -154,6 +155,7 @@ rule mdl_o_dictys:
         p2g=temp(local('dts/{dat}/cases/{case}/runs/o_dictys.o_dictys.p2g.csv')),
         tfb=temp(local('dts/{dat}/cases/{case}/runs/o_dictys.o_dictys.o_dictys.tfb.csv')),
         out='dts/{dat}/cases/{case}/runs/o_dictys.o_dictys.o_dictys.o_dictys.mdl.csv',
+    benchmark: 'dts/{dat}/cases/{case}/runs/o_dictys.o_dictys.o_dictys.o_dictys.bench.tsv'
     params:
         ext=config['methods']['dictys']['ext'] // 2,
         n_p2g_links=config['methods']['dictys']['n_p2g_links'],
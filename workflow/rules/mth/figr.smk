@@ -3,7 +3,7 @@ rule pre_figr:
     singularity: 'workflow/envs/figr.sif'
     input:
         img='workflow/envs/figr.sif',
-        mdata=rules.extract_case.output.mdata
+        mdata=dense_mdata
     output:
         out='dts/{dat}/cases/{case}/runs/figr.pre.h5mu'
     resources:
@@ -93,6 +93,7 @@ rule mdl_figr:
         tfb=lambda wildcards: map_rules('tfb', wildcards.tfb),
     output:
         out='dts/{dat}/cases/{case}/runs/{pre}.{p2g}.{tfb}.figr.mdl.csv'
+    benchmark: 'dts/{dat}/cases/{case}/runs/{pre}.{p2g}.{tfb}.figr.bench.tsv'
     params:
         cellK=config['methods']['figr']['cellK'],
         thr_score=config['methods']['figr']['thr_score'],
@@ -120,9 +121,10 @@ rule mdl_figr:
 rule mdl_o_figr:
     threads: 1
     singularity: 'workflow/envs/figr.sif'
-    input: rules.extract_case.output.mdata,
+    input: dense_mdata,
     output:
         out='dts/{dat}/cases/{case}/runs/o_figr.o_figr.o_figr.o_figr.mdl.csv'
+    benchmark: 'dts/{dat}/cases/{case}/runs/o_figr.o_figr.o_figr.o_figr.bench.tsv'
     params:
         organism=lambda w: config['dts'][w.dat]['organism'],
         ext=config['methods']['figr']['ext'],
@@ -3,7 +3,7 @@ rule pre_granie:
     singularity: 'workflow/envs/granie.sif'
     input:
         img='workflow/envs/granie.sif',
-        mdata=rules.extract_case.output.mdata
+        mdata=dense_mdata
     output:
         out='dts/{dat}/cases/{case}/runs/granie.pre.h5mu'
     resources:
@@ -101,6 +101,7 @@ rule mdl_granie:
     output:
         t=temp(directory(local('dts/{dat}/cases/{case}/runs/{pre}.{p2g}.{tfb}.granie_tmp'))),
         out='dts/{dat}/cases/{case}/runs/{pre}.{p2g}.{tfb}.granie.mdl.csv'
+    benchmark: 'dts/{dat}/cases/{case}/runs/{pre}.{p2g}.{tfb}.granie.bench.tsv'
     params: thr_fdr=config['methods']['granie']['thr_fdr'],
     resources:
         mem_mb=restart_mem,
@@ -129,13 +130,14 @@ rule mdl_o_granie:
     threads: 1
     singularity: 'workflow/envs/granie.sif'
     input:
-        mdata=rules.extract_case.output.mdata,
+        mdata=dense_mdata,
         gid=rules.gen_gid_ensmbl.output,
         tfb=rules.gen_motif_granie.output,
     output:
         h=temp(local('dts/{dat}/cases/{case}/runs/pre.granie.src.h5mu')),
         t=temp(directory(local('dts/{dat}/cases/{case}/runs/granie_tmp.src'))),
         out='dts/{dat}/cases/{case}/runs/o_granie.o_granie.o_granie.o_granie.mdl.csv'
+    benchmark: 'dts/{dat}/cases/{case}/runs/o_granie.o_granie.o_granie.o_granie.bench.tsv'
     params:
         ext=config['methods']['granie']['ext'],
         thr_fdr=config['methods']['granie']['thr_fdr'],
@@ -19,11 +19,12 @@ rule mdl_collectri:
     threads: 1
     singularity: 'workflow/envs/gretabench.sif'
     input:
-        mdata=rules.extract_case.output.mdata,
+        mdata=dense_mdata,
         grn=rules.gst_collectri.output,
         proms=rules.cre_promoters.output,
     output:
         out='dts/{dat}/cases/{case}/runs/collectri.collectri.collectri.collectri.mdl.csv'
+    benchmark: 'dts/{dat}/cases/{case}/runs/collectri.collectri.collectri.collectri.bench.tsv'
     resources:
         mem_mb=restart_mem,
         runtime=config['max_mins_per_step'],
@@ -41,11 +42,12 @@ rule mdl_dorothea:
     threads: 1
     singularity: 'workflow/envs/gretabench.sif'
     input:
-        mdata=rules.extract_case.output.mdata,
+        mdata=dense_mdata,
         grn=rules.gst_dorothea.output,
         proms=rules.cre_promoters.output,
     output:
         out='dts/{dat}/cases/{case}/runs/dorothea.dorothea.dorothea.dorothea.mdl.csv'
+    benchmark: 'dts/{dat}/cases/{case}/runs/dorothea.dorothea.dorothea.dorothea.bench.tsv'
     resources:
         mem_mb=restart_mem,
         runtime=config['max_mins_per_step'],
@@ -3,7 +3,7 @@ rule pre_pando:
     singularity: 'workflow/envs/pando.sif'
     input:
         img='workflow/envs/pando.sif',
-        mdata=rules.extract_case.output.mdata,
+        mdata=dense_mdata,
         ann=rules.gen_ann_pando.output,
     output:
         p=temp(local('dts/{dat}/cases/{case}/runs/pando.peaks.csv')),
@@ -96,6 +96,7 @@ rule mdl_pando:
         tfb=lambda wildcards: map_rules('tfb', wildcards.tfb),
     output:
         out='dts/{dat}/cases/{case}/runs/{pre}.{p2g}.{tfb}.pando.mdl.csv'
+    benchmark: 'dts/{dat}/cases/{case}/runs/{pre}.{p2g}.{tfb}.pando.bench.tsv'
     params:
         thr_corr=config['methods']['pando']['thr_corr'],
         p_thresh=config['methods']['pando']['p_thresh'],
@@ -130,10 +131,11 @@ rule mdl_o_pando:
     threads: 1
     singularity: 'workflow/envs/pando.sif'
     input:
-        mdata=rules.extract_case.output.mdata,
+        mdata=dense_mdata,
         ann=rules.gen_ann_pando.output,
     output:
         out='dts/{dat}/cases/{case}/runs/o_pando.o_pando.o_pando.o_pando.mdl.csv'
+    benchmark: 'dts/{dat}/cases/{case}/runs/o_pando.o_pando.o_pando.o_pando.bench.tsv'
     params:
         exclude_exons=config['methods']['pando']['exclude_exons'],
         ext=config['methods']['pando']['ext'],
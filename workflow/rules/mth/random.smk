@@ -2,10 +2,11 @@ rule mdl_random:
     threads: 1
     singularity: 'workflow/envs/gretabench.sif'
     input:
-        mdata=rules.extract_case.output.mdata,
+        mdata=dense_mdata,
         tf=rules.gen_tfs_lambert.output,
         cg=rules.cre_promoters.output,
     output: out='dts/{dat}/cases/{case}/runs/random.random.random.random.mdl.csv'
+    benchmark: 'dts/{dat}/cases/{case}/runs/random.random.random.random.bench.tsv'
     params:
         g_perc=0.25,
         scale=1,
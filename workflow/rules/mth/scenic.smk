@@ -3,7 +3,7 @@ rule mdl_scenic:
     singularity: 'workflow/envs/scenicplus.sif'
     input:
         img='workflow/envs/scenicplus.sif',
-        mdata=rules.extract_case.output.mdata,
+        mdata=dense_mdata,
         tf=rules.gen_tfs_scenic.output,
         proms=rules.cre_promoters.output,
         ranking_small=rules.gen_motif_scenic_rnk.output.sml,
@@ -14,6 +14,7 @@ rule mdl_scenic:
         t=temp(local('dts/{dat}/cases/{case}/runs/scenic_tmp.loom')),
         reg=temp(local('dts/{dat}/cases/{case}/runs/scenic_reg.csv')),
         out='dts/{dat}/cases/{case}/runs/scenic.scenic.scenic.scenic.mdl.csv'
+    benchmark: 'dts/{dat}/cases/{case}/runs/scenic.scenic.scenic.scenic.bench.tsv'
     resources:
         mem_mb=restart_mem,
         runtime=config['max_mins_per_step'] * 2,
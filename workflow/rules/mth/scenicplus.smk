@@ -3,7 +3,7 @@ rule mdl_o_scenicplus:
     singularity: 'workflow/envs/scenicplus.sif'
     input:
         img='workflow/envs/scenicplus.sif',
-        mdata=rules.extract_case.output.mdata,
+        mdata=dense_mdata,
         blist=rules.cre_blacklist.output,
         rnk=rules.gen_motif_scenicplus.output.human_rankings,
         man=rules.gen_motif_scenicplus.output.human_annot,
@@ -13,6 +13,7 @@ rule mdl_o_scenicplus:
     output:
         dir=directory('dts/{dat}/cases/{case}/runs/scenicplus/'),
         out='dts/{dat}/cases/{case}/runs/o_scenicplus.o_scenicplus.o_scenicplus.o_scenicplus.mdl.csv'
+    benchmark: 'dts/{dat}/cases/{case}/runs/o_scenicplus.o_scenicplus.o_scenicplus.o_scenicplus.bench.tsv'
     params:
         ntopics=config['methods']['scenicplus']['ntopics'],
         ext=config['methods']['scenicplus']['ext'] // 2,
@@ -47,7 +48,7 @@ rule pre_scenicplus:
     threads: 1
     singularity: 'workflow/envs/scenicplus.sif'
     input:
-        mdata=rules.extract_case.output.mdata,
+        mdata=dense_mdata,
         dir=rules.mdl_o_scenicplus.output.dir,
     output:
         out='dts/{dat}/cases/{case}/runs/scenicplus.pre.h5mu'
@@ -130,6 +131,7 @@ rule mdl_scenicplus:
         rnk=rules.gen_motif_scenicplus.output.human_rankings,
     output:
         out='dts/{dat}/cases/{case}/runs/{pre}.{p2g}.{tfb}.scenicplus.mdl.csv'
+    benchmark: 'dts/{dat}/cases/{case}/runs/{pre}.{p2g}.{tfb}.scenicplus.bench.tsv'
     resources:
         mem_mb=lambda wildcards, attempt: restart_mem(wildcards, attempt) * 2,
         runtime=config['max_mins_per_step'],
@@ -1,7 +1,9 @@
 import pandas as pd
-import numpy as np
 import os
+import sys
 import argparse
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from utils import parse_score_path, read_scores
 
 
 # Init args
@@ -15,18 +17,39 @@ df_paths = args['path_input']
 add_info = args['add_info']
 path_out = args['path_out']
 
+
+def read_db(db_path):
+    """Scores of a batch job, from its scores db (anl/metrics/{metric}/{task}/{db}/{dts}.{case}.scores.db)"""
+    df = read_scores(db_path, **parse_score_path(db_path))
+    # Stored as 0 / 1, back to the True / False of the grn csvs
+    df['partial'] = df['partial'].map({0: False, 1: True})
+    return df
+
+
+def read_csv(df_path):
+    """Scores of one grn csv (anl/metrics/{metric}/{task}/{db}/{dts}/{name}.scores.csv)"""
+    df = pd.read_csv(df_path)
+    if add_info:
+        metric, task, db, dts = os.path.normpath(df_path).split(os.sep)[-5:-1]
+        df[['metric', 'task', 'db', 'dts']] = [metric, task, db, dts]
+    return df
+
+
 df = []
 for df_path in df_paths:
-    tmp = pd.read_csv(df_path)
+    if df_path.endswith('.scores.db'):
+        tmp = read_db(df_path)
+        # Same dts column as the grn csvs, named after their {dts}.{case} folder
+        tmp['dts'] = tmp['dts'] + '.' + tmp['case']
+        # Keep the partial flag of metrics that can stop early (sss)
+        cols = ['name', 'prc', 'rcl', 'f01'] + (['partial'] if tmp['partial'].notna().any() else []) + ['status']
+        tmp = tmp[cols] if not add_info else tmp
+    else:
+        tmp = read_csv(df_path)
     if add_info:
-        dts = os.path.basename(os.path.dirname(df_path))
-        db = os.path.basename(os.path.dirname(os.path.dirname(df_path)))
-        task = os.path.basename(os.path.dirname(os.path.dirname(os.path.dirname(df_path))))
-        metric = os.path.basename(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(df_path)))))
-        tmp[['metric', 'task', 'db', 'dts']] = [metric, task, db, dts]
-        tmp = tmp[['metric', 'task', 'db', 'dts', 'name', 'prc', 'rcl', 'f01']]
+        tmp = tmp.reindex(columns=['metric', 'task', 'db', 'dts', 'name', 'prc', 'rcl', 'f01', 'status'])
     df.append(tmp)
 df = pd.concat(df)
 
 # Write
-df.to_csv(path_out, index=False)
\ No newline at end of file
+df.to_csv(path_out, index=False)
@@ -0,0 +1,72 @@
+import pandas as pd
+import numpy as np
+import anndata as ad
+import sys
+import os
+import argparse
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from prt import get_tf_dict, init_celloracle, simulate_delta, fit_coef_matrix, simulate_deltas, iter_deltas
+
+
+# Compare the native prt engine against celloracle on a small random grn
+parser = argparse.ArgumentParser()
+parser.add_argument('-c','--n_cells', required=False, type=int, default=300)
+parser.add_argument('-g','--n_genes', required=False, type=int, default=40)
+parser.add_argument('-t','--n_tfs', required=False, type=int, default=8)
+parser.add_argument('-s','--seed', required=False, type=int, default=42)
+parser.add_argument('-r','--rtol', required=False, type=float, default=1e-6)
+args = vars(parser.parse_args())
+
+n_cells = args['n_cells']
+n_genes = args['n_genes']
+n_tfs = args['n_tfs']
+seed = args['seed']
+rtol = args['rtol']
+
+
+def make_fixture(n_cells, n_genes, n_tfs, seed):
+    """Log-normal expression and a signed grn where each tf regulates 3 to 10 genes"""
+    rng = np.random.default_rng(seed)
+    genes = ['G{0}'.format(i) for i in range(n_genes)]
+    X = rng.lognormal(mean=0., sigma=1., size=(n_cells, n_genes))
+    adata = ad.AnnData(X, obs=pd.DataFrame(index=['C{0}'.format(i) for i in range(n_cells)]), var=pd.DataFrame(index=genes))
+    grn = []
+    for tf in genes[:n_tfs]:
+        trgs = rng.choice([g for g in genes if g != tf], rng.integers(3, 11), replace=False)
+        grn += [[tf, trg, rng.normal()] for trg in trgs]
+    grn = pd.DataFrame(grn, columns=['source', 'target', 'score'])
+    return adata, grn
+
+
+adata, grn = make_fixture(n_cells, n_genes, n_tfs, seed)
+
+# Celloracle engine, as prt.evaluate runs it
+oracle = init_celloracle(adata.copy(), grn, fit_grn=True)
+co_coef = oracle.coef_matrix
+co_gem = oracle.adata.to_df().mean(0)
+oracle = init_celloracle(ad.AnnData(co_gem.to_frame().T), grn, fit_grn=False)
+oracle.coef_matrix = co_coef
+tfs = list(oracle.all_regulatory_genes_in_TFdict)
+co_deltas = {tf: simulate_delta(oracle, [tf], n_steps=3) for tf in tfs}
+
+# Native engine
+gem = adata.to_df()
+coef = fit_coef_matrix(gem, get_tf_dict(grn))
+gem = gem.mean(0)
+nt_deltas = dict(iter_deltas(simulate_deltas(coef, gem, tfs, n_steps=3)))
+
+# Compare fitted coefs and the deltas of each knockdown
+coef = pd.DataFrame(coef.toarray(), index=gem.index, columns=gem.index)
+co_coef = co_coef.reindex(index=gem.index, columns=gem.index, fill_value=0.)
+err_coef = np.abs(coef.values - co_coef.values).max()
+is_ok = np.allclose(coef.values, co_coef.values, rtol=rtol, atol=rtol)
+print('coefs: {0} non-zero, max abs diff {1:.3g}'.format((coef.values != 0).sum(), err_coef))
+for tf in tfs:
+    x, y = nt_deltas[tf], co_deltas[tf]
+    same_genes = set(x.columns) == set(y.columns)
+    err = np.abs(x.loc[:, y.columns].values - y.values).max() if same_genes else np.inf
+    is_ok &= same_genes and np.allclose(x.loc[:, y.columns].values, y.values, rtol=rtol, atol=rtol)
+    print('{0}: {1} shifted genes, max abs diff {2:.3g}'.format(tf, y.shape[1], err))
+if not is_ok:
+    sys.exit('native prt engine differs from celloracle')
+print('native prt engine matches celloracle')
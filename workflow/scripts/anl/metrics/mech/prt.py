@@ -4,47 +4,37 @@ import mudata as mu
 import anndata as ad
 import sys
 import os
-import re
 import appdirs
 import tempfile
+import hashlib
+import signal
+import glob
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 import argparse
 
 
-# Init args
-parser = argparse.ArgumentParser()
-parser.add_argument('-i','--grn_path', required=True)
-parser.add_argument('-b','--bnc_path', required=True)
-parser.add_argument('-o','--out_path', required=True)
-args = vars(parser.parse_args())
-
-grn_path = args['grn_path']
-bnc_path = args['bnc_path']
-out_path = args['out_path']
-
-grn_name = os.path.basename(grn_path).replace('.grn.csv', '')
 def user_cache_dir(*args, **kwargs):
     tmp_dir = tempfile.gettempdir()
-    return os.path.join(tmp_dir, grn_name)
+    return os.path.join(tmp_dir, 'celloracle_{0}'.format(os.getpid()))
 sys.modules["appdirs"].user_cache_dir = user_cache_dir
 
-from celloracle import Oracle
-import celloracle.trajectory.oracle_utility as co
+from sklearn.linear_model import Ridge
 import scipy
+import scipy.sparse
 from tqdm import tqdm
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from utils import load_cats, f_beta_score
+from utils import f_beta_score, read_grn, get_grn_info, get_case_info, load_knocktf, hash_file, run_evaluate
+
 
-# Extract names and path
-data_path = os.path.join(os.path.dirname(os.path.dirname(grn_path)), 'mdata.h5mu')
-dataset = os.path.basename(os.path.dirname(os.path.dirname(os.path.dirname(data_path))))
-case = os.path.basename(os.path.dirname(data_path))
-rsc_name = os.path.basename(bnc_path)
+def get_tf_dict(grn):
+    return grn.groupby(['target'])['source'].apply(lambda x: sorted(list(x))).to_dict()
 
-# Read GRN
-grn = pd.read_csv(grn_path)
-grn = grn.drop_duplicates(['source', 'target'], keep='first')
 
 def init_celloracle(adata, grn, fit_grn):
+    from celloracle import Oracle
+    import celloracle.trajectory.oracle_utility as co
     oracle = Oracle()
     oracle.adata = adata
     oracle.adata.obsm['X_umap'] = np.zeros((adata.shape[0], 2))
@@ -62,7 +52,7 @@ def init_celloracle(adata, grn, fit_grn):
                                               cluster_name='cluster',
                                               return_as="dict")
     oracle.colorandum = np.array([col_dict[i] for i in oracle.adata.obs['cluster']])
-    tf_dict = grn.groupby(['target'])['source'].apply(lambda x: sorted(list(x))).to_dict()   # Refit GRN
+    tf_dict = get_tf_dict(grn)   # Refit GRN
     oracle.addTFinfo_dictionary(tf_dict)
     # Add grn
     if fit_grn:
@@ -89,77 +79,260 @@ def simulate_delta(oracle, tfs, n_steps=3):
     return delta
 
 
-if grn.shape[0] > 0:
-    # Read dataset
+def fit_coef_matrix(gem, tf_dict):
+    """Fit each target on its regulators with an unregularized Ridge,
+    as Oracle.fit_GRN_for_simulation(alpha=0, GRN_unit='whole') does.
+    Returns the regulators x targets coefs as a sparse matrix over gem columns"""
+    genes = gem.columns
+    X = gem.values
+    rows, cols, vals = [], [], []
+    for target in tqdm(genes.intersection(list(tf_dict))):
+        regs = [g for g in tf_dict[target] if (g in genes) and (g != target)]
+        if len(regs) > 0:
+            regs = genes.get_indexer(regs)
+            model = Ridge(alpha=0, random_state=123).fit(X[:, regs], X[:, genes.get_loc(target)])
+            rows.append(regs)
+            cols.append(np.full(regs.size, genes.get_loc(target)))
+            vals.append(model.coef_)
+    if len(rows) > 0:
+        rows, cols, vals = np.concatenate(rows), np.concatenate(cols), np.concatenate(vals)
+    coef = scipy.sparse.csc_matrix((vals, (rows, cols)), shape=(genes.size, genes.size))
+    coef.eliminate_zeros()
+    return coef
+
+
+def simulate_deltas(coef, gem, tfs, n_steps=3):
+    """Knock down each tf of tfs in the mean expression profile gem and propagate
+    the shift n_steps through the sparse coef matrix over gem genes, as
+    Oracle.simulate_shift does. Returns tfs x genes"""
+    genes = gem.index
+    gem = gem.values
+    idx = genes.get_indexer(tfs)
+    delta_input = np.zeros((idx.size, genes.size))
+    delta_input[np.arange(idx.size), idx] = 0 - gem[idx]
+    msk = delta_input != 0
+    delta = delta_input.copy()
+    for i in range(n_steps):
+        delta = (coef.T @ delta.T).T
+        delta[msk] = delta_input[msk]
+        # Expression cannot be negative
+        delta = np.maximum(gem + delta, 0) - gem
+    delta = (gem + delta) - gem
+    return pd.DataFrame(delta, index=tfs, columns=genes)
+
+
+def iter_deltas(deltas):
+    """Yield each tf knockdown of deltas with its non-zero shifts, like simulate_delta"""
+    for tf in deltas.index:
+        delta = deltas.loc[[tf], :]
+        yield tf, delta.loc[:, delta.abs().sum(0) != 0]
+
+
+class SimTimeout(TimeoutError):
+    pass
+
+
+def raise_timeout(signum, frame):
+    raise SimTimeout()
+
+
+def init_worker():
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+# Fitted oracle of the grn being evaluated, inherited by forked workers
+oracle = None
+
+
+def simulate_tf(tf):
+    return tf, simulate_delta(oracle, [tf], n_steps=3)
+
+
+def run_simulations(tfs, n_jobs=1):
+    """Yield the simulated delta of each tf knockdown, across n_jobs workers"""
+    if n_jobs > 1:
+        pool = ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context('fork'), initializer=init_worker)
+        try:
+            futures = [pool.submit(simulate_tf, tf) for tf in tfs]
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+    else:
+        for tf in tfs:
+            yield simulate_tf(tf)
+
+
+def get_ckpt_path(grn_path, ctx):
+    """Checkpoint of a grn, keyed by the grn content, the benchmark files and
+    the engine. Checkpoints of the grn with another key are stale and removed"""
+    if ctx['ckpt_dir'] is None:
+        return None
+    grn_name = get_grn_info(grn_path)[0]
+    key = [hash_file(grn_path), ctx['engine']]
+    for name in ['diff.csv', 'meta.csv']:
+        stat = os.stat(os.path.join(ctx['bnc_path'], name))
+        key += [stat.st_size, stat.st_mtime_ns]
+    key = hashlib.blake2b('|'.join(map(str, key)).encode(), digest_size=8).hexdigest()
+    ckpt_path = os.path.join(ctx['ckpt_dir'], '{0}.{1}.prt.ckpt.csv'.format(grn_name, key))
+    for path in glob.glob(os.path.join(ctx['ckpt_dir'], glob.escape(grn_name) + '.*.prt.ckpt.csv')):
+        if path != ckpt_path:
+            os.remove(path)
+    return ckpt_path
+
+
+def read_ckpt(ckpt_path):
+    """Correlations of already scored experiments"""
+    if ckpt_path is not None and os.path.isfile(ckpt_path):
+        ckpt = pd.read_csv(ckpt_path, index_col=0)
+    else:
+        ckpt = pd.DataFrame(columns=['coef', 'pval'])
+    return ckpt
+
+
+def write_ckpt(ckpt_path, rows):
+    if ckpt_path is not None:
+        rows = pd.DataFrame(rows, columns=['dataset', 'coef', 'pval']).set_index('dataset')
+        rows.to_csv(ckpt_path, mode='a', header=not os.path.isfile(ckpt_path))
+
+
+def prepare(grn_paths, bnc_path, n_jobs=1, ckpt_dir=None, engine='celloracle'):
+    data_path, dataset, case = get_case_info(grn_paths)
+
+    # Read dataset, celloracle and the native engine need a dense X (sparse cases store csr)
     rna = mu.read(os.path.join(data_path, 'mod', 'rna'))
+    if scipy.sparse.issparse(rna.X):
+        rna.X = rna.X.toarray()
+
+    # Read benchmark data subset to dataset
+    obs, mat = load_knocktf(bnc_path, data_path, dataset, case)
+    return dict(rna=rna, obs=obs, mat=mat, n_jobs=int(n_jobs), ckpt_dir=ckpt_dir, engine=engine, bnc_path=bnc_path)
+
+
+def evaluate(grn_path, ctx):
+    global oracle
+    grn_name = get_grn_info(grn_path)[0]
+    rna, obs, mat = ctx['rna'], ctx['obs'], ctx['mat']
+
+    # Read GRN
+    grn = read_grn(grn_path, columns=['source', 'target', 'score'], dedup=True)
+
+    if grn.shape[0] > 0:
+        # Subset data to grn
+        genes = set(grn['source']) | set(grn['target'])
+        rna = rna[:, rna.var_names.isin(genes)]
+
+        # Fit grn and collapse data to its mean profile
+        if ctx['engine'] == 'celloracle':
+            oracle = init_celloracle(rna, grn, fit_grn=True)
+            coef_mat = oracle.coef_matrix
+            gem = oracle.adata.to_df().mean(0)
+            tf_n_trgs = (coef_mat != 0).sum(0)
+        else:
+            gem = rna.to_df()
+            coef_mat = fit_coef_matrix(gem, get_tf_dict(grn))
+            gem = gem.mean(0)
+            tf_n_trgs = pd.Series(coef_mat.getnnz(axis=0), index=gem.index)
+        tf_n_trgs = set(tf_n_trgs[tf_n_trgs >= 3].index)
+        regs = [t for t in np.unique(grn['source']) if t in tf_n_trgs]
+        if ctx['engine'] == 'celloracle':
+            oracle = ad.AnnData(gem.to_frame().T)
+            oracle = init_celloracle(oracle, grn, fit_grn=False)
+            oracle.coef_matrix = coef_mat
+            oracle.all_regulatory_genes_in_TFdict = regs
 
-    # Subset data to grn
-    genes = set(grn['source']) | set(grn['target'])
-    rna = rna[:, rna.var_names.isin(genes)]
-
-    # Init object
-    oracle = init_celloracle(rna, grn, fit_grn=True)
-    coef_mat = oracle.coef_matrix
-    oracle = ad.AnnData(oracle.adata.to_df().mean(0).to_frame().T)
-    oracle = init_celloracle(oracle, grn, fit_grn=False)
-    oracle.coef_matrix = coef_mat
-    tf_n_trgs = (coef_mat != 0).sum(0)
-    tf_n_trgs = set(tf_n_trgs[tf_n_trgs >= 3].index)
-    oracle.all_regulatory_genes_in_TFdict = [t for t in oracle.all_regulatory_genes_in_TFdict if t in tf_n_trgs]
-
-    # Read benchmark data
-    mat = pd.read_csv(os.path.join(bnc_path, 'diff.csv'), index_col=0)
-    obs = pd.read_csv(os.path.join(bnc_path, 'meta.csv'), index_col=0)
-
-    # Subset bench data to dataset
-    cats = load_cats(dataset, case)
-    cats = [re.escape(c) for c in cats[rsc_name]]
-    msk = obs['Tissue.Type'].isin(cats) & obs['TF'].isin(rna.var_names) & (obs['logFC'] < -0.5)
-    obs = obs.loc[msk, :]
-    mat = mat.loc[msk, :]
-
-    # Subset by overlap with rna
-    genes = list(genes & set(mat.columns))
-    mat = mat.loc[:, genes].copy()
-    
-    coefs = []
-    pvals = []
-    for dataset in tqdm(obs.index):
-        # Extract
-        tf = obs.loc[dataset, 'TF']
-        tf_mat = mat.loc[[dataset], :]
-        tf_mat = tf_mat[tf_mat != 0].dropna(axis=1)
-        if tf in oracle.all_regulatory_genes_in_TFdict:
-            # Run the simulation for the current TF
-            x = simulate_delta(oracle, [tf], n_steps=3)
-            
-            # Intersect
-            y = tf_mat
-            inter = np.intersect1d(x.columns, y.columns)
-            x, y = x.loc[:, inter].values[0], y.loc[:, inter].values[0]
-
-            # Compute correlation
-            if x.size >= 10:
-                r, p = scipy.stats.spearmanr(x, y)
-            else:
-                r, p = 0., 1.
-            coefs.append(r)
-            pvals.append(p)
-    
-    # Compute recall
-    coefs = np.array(coefs)
-    pvals = np.array(pvals)
-    padj = scipy.stats.false_discovery_control(pvals, method='bh')
-    tp = np.sum((coefs > 0.05) & (padj < 0.05))
-    if tp > 0:
-        prc = tp / coefs.size
-        rcl = tp / obs.shape[0]
-        f01 = f_beta_score(prc, rcl)
+        # Subset bench data to measured grn genes
+        msk = obs['TF'].isin(rna.var_names)
+        obs = obs.loc[msk, :]
+        mat = mat.loc[msk, :]
+
+        # Subset by overlap with rna
+        genes = list(genes & set(mat.columns))
+        mat = mat.loc[:, genes].copy()
+
+        # Resume from previously scored experiments
+        ckpt_path = get_ckpt_path(grn_path, ctx)
+        ckpt = read_ckpt(ckpt_path)
+        res = {d: (r, p) for d, r, p in zip(ckpt.index, ckpt['coef'], ckpt['pval'])}
+
+        # Simulate each knocked down TF once
+        is_reg = obs['TF'].isin(regs)
+        tf_dts = obs.loc[is_reg & ~obs.index.isin(list(res)), :].groupby('TF').groups
+        if ctx['engine'] == 'celloracle':
+            sims = run_simulations(list(tf_dts), n_jobs=ctx['n_jobs'])
+        else:
+            sims = iter_deltas(simulate_deltas(coef_mat, gem, list(tf_dts), n_steps=3))
+        try:
+            for tf, x in tqdm(sims, total=len(tf_dts)):
+                rows = []
+                for dataset in tf_dts[tf]:
+                    # Extract
+                    y = mat.loc[[dataset], :]
+                    y = y[y != 0].dropna(axis=1)
+
+                    # Intersect
+                    inter = np.intersect1d(x.columns, y.columns)
+                    x_d, y_d = x.loc[:, inter].values[0], y.loc[:, inter].values[0]
+
+                    # Compute correlation
+                    if x_d.size >= 10:
+                        r, p = scipy.stats.spearmanr(x_d, y_d)
+                    else:
+                        r, p = 0., 1.
+                    res[dataset] = (r, p)
+                    rows.append([dataset, r, p])
+                write_ckpt(ckpt_path, rows)
+        except (TimeoutError, BrokenProcessPool):
+            print('Simulation interrupted, scoring the experiments done so far')
+        finally:
+            sims.close()
+        coefs = [res[d][0] for d in obs.index[is_reg] if d in res]
+        pvals = [res[d][1] for d in obs.index[is_reg] if d in res]
+
+        # Compute recall
+        coefs = np.array(coefs)
+        pvals = np.array(pvals)
+        padj = scipy.stats.false_discovery_control(pvals, method='bh')
+        tp = np.sum((coefs > 0.05) & (padj < 0.05))
+        if tp > 0:
+            prc = tp / coefs.size
+            rcl = tp / obs.shape[0]
+            f01 = f_beta_score(prc, rcl)
+        else:
+            prc, rcl, f01 = 0., 0., 0.
+        df = pd.DataFrame([[grn_name, prc, rcl, f01]], columns=['name', 'prc', 'rcl', 'f01'])
     else:
-        prc, rcl, f01 = 0., 0., 0.
-    df = pd.DataFrame([[grn_name, prc, rcl, f01]], columns=['name', 'prc', 'rcl', 'f01'])
-else:
-    df = pd.DataFrame([[grn_name, np.nan, np.nan, np.nan]], columns=['name', 'prc', 'rcl', 'f01'])
+        df = pd.DataFrame([[grn_name, np.nan, np.nan, np.nan]], columns=['name', 'prc', 'rcl', 'f01'])
+    return df
+
+
+if __name__ == '__main__':
+    # Init args
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i','--grn_path', required=True)
+    parser.add_argument('-b','--bnc_path', required=True)
+    parser.add_argument('-o','--out_path', required=True)
+    parser.add_argument('-n','--n_jobs', required=False, type=int, default=1,
+                        help='Simulation workers of the celloracle engine, the native engine simulates all tfs at once')
+    parser.add_argument('-e','--engine', required=False, default='celloracle', choices=['celloracle', 'native'],
+                        help='native refits and propagates the grn with numpy / scipy, check_prt.py compares it against celloracle')
+    args = vars(parser.parse_args())
+
+    grn_path = args['grn_path']
+    bnc_path = args['bnc_path']
+    out_path = args['out_path']
+    n_jobs = args['n_jobs']
+    engine = args['engine']
+
+    # Score the experiments simulated so far when killed by the rule timeout
+    signal.signal(signal.SIGTERM, raise_timeout)
+
+    # Evaluate
+    ctx = prepare([grn_path], bnc_path=bnc_path, n_jobs=n_jobs, ckpt_dir=os.path.dirname(out_path), engine=engine)
+    df = run_evaluate(evaluate, grn_path, ctx)
 
-# Write
-df.to_csv(out_path, index=False)
+    # Write, scored grns no longer need their checkpoint, failed ones keep it for a rerun
+    df.to_csv(out_path, index=False)
+    ckpt_path = get_ckpt_path(grn_path, ctx)
+    if (df['status'] == 'ok').all() and (ckpt_path is not None) and os.path.isfile(ckpt_path):
+        os.remove(ckpt_path)
@@ -1,12 +1,21 @@
-from pyboolnet import file_exchange, trap_spaces
+from pyboolnet.external.bnet2primes import CMD_BNET2PRIMES
+from pyboolnet.external.potassco import primes2asp, CMD_GRINGO, CMD_CLASP
 import scipy.stats as scs
 import pandas as pd
 import numpy as np
-import decoupler as dc
+import subprocess
+import threading
+import time
+import ast
 import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from utils import f_beta_score
+from utils import f_beta_score, read_grn, get_grn_info, fisher_sf, run_evaluate
+import argparse
+
+
+# Number of set bits of each uint8
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
 
 
 def define_bool_rules(grn):
@@ -36,28 +45,114 @@ def define_bool_rules(grn):
     return rules
 
 
-def compute_fisher(hits, ct_set, tfs):
-    a = hits & ct_set
-    b = hits - ct_set
-    c = ct_set - hits
-    d = tfs - a - b - c
-    a, b, c, d = len(a), len(b), len(c), len(d)
-    p = dc.test1r(a, b, c, d)
-    return p
-
-
-def find_hits(sss, ct_sets, tfs, thr_pval):
-    pvals = np.zeros((len(sss), ct_sets.shape[0]))
-    for i, pss in enumerate(sss):
-        hits = set()
-        for k in pss:
-            if pss[k]:
-                hits.add(k)
-        for j, ct_set in enumerate(ct_sets):
-            pvals[i, j] = compute_fisher(hits, ct_set, tfs)
+def get_remaining(deadline):
+    """Seconds left before deadline (None for no deadline)"""
+    return None if deadline is None else max(deadline - time.time(), 0.)
+
+
+def bnet2primes(rules, deadline=None):
+    """Prime implicants of bnet rules like file_exchange.bnet2primes, None if
+    BNetToPrime does not finish before deadline"""
+    proc = subprocess.Popen([CMD_BNET2PRIMES], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        out, _ = proc.communicate(input=rules.encode(), timeout=get_remaining(deadline))
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        return None
+    if proc.returncode != 0:
+        raise RuntimeError('call to bnet2prime failed')
+    out = out.decode().replace('\x08', '').replace(' ', '')
+    return ast.literal_eval(out)
+
+
+def iter_steady_states(primes, max_output=100_000, deadline=None):
+    """Stream the steady states of primes from clasp as they are enumerated,
+    like trap_spaces.compute_steady_states. gringo and clasp are killed at
+    deadline, ending the stream even if they stall between states"""
+    n = len(primes)
+    asp_text = primes2asp(primes=primes, fname_asp=None, bounds=(n, n), project=[], type_='all')
+    cmd_clasp = [CMD_CLASP, f'--models={max_output}', '--project']
+    if deadline is not None:
+        cmd_clasp.append('--time-limit={0}'.format(max(int(get_remaining(deadline)), 1)))
+    proc_gringo = subprocess.Popen([CMD_GRINGO], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    proc_clasp = subprocess.Popen(
+        cmd_clasp,
+        stdin=proc_gringo.stdout, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    proc_gringo.stdout.close()
+    procs = [proc_clasp, proc_gringo]
+    timer = None
+    if deadline is not None:
+        timer = threading.Timer(get_remaining(deadline), lambda: [proc.kill() for proc in procs])
+        timer.daemon = True
+        timer.start()
+    try:
+        try:
+            proc_gringo.stdin.write(asp_text.encode())
+            proc_gringo.stdin.close()
+        except BrokenPipeError:
+            pass
+        for line in proc_clasp.stdout:
+            if line.startswith('Answer'):
+                line = next(proc_clasp.stdout, '')
+                pss = [x[4:-1].split(',') for x in line.split()]
+                yield {k[1:-1]: int(v) for k, v in pss}
+        if 'ERROR' in proc_clasp.stderr.read():
+            raise RuntimeError('call to gringo and / or clasp failed')
+    finally:
+        if timer is not None:
+            timer.cancel()
+        for proc in procs:
+            proc.kill()
+            proc.wait()
+
+
+def pack_sets(sets, tfs):
+    """Bit-vectors over the tfs universe of a list of sets"""
+    tfs = pd.Index(tfs)
+    msk = np.zeros((len(sets), tfs.size), dtype=bool)
+    for i, s in enumerate(sets):
+        msk[i, tfs.get_indexer(list(s))] = True
+    return np.packbits(msk, axis=1)
+
+
+def compute_fisher(ss_bits, ct_bits, n_tfs):
+    """One-tailed Fisher test of each steady state against each cell type set"""
+    a = POPCOUNT[ss_bits[:, None, :] & ct_bits[None, :, :]].sum(2)
+    ab = POPCOUNT[ss_bits].sum(1)[:, None]
+    ac = POPCOUNT[ct_bits].sum(1)[None, :]
+    return fisher_sf(a, ab, ac, n_tfs).reshape(a.shape)
+
+
+def find_hits(sss, ct_sets, tfs, thr_pval, max_states=None, deadline=None, chunk_size=1024):
+    """Test steady states as they come in chunks. Stops after max_states states or
+    at deadline, flagging the result as partial if states were left"""
+    tfs = sorted(tfs)
+    ct_bits = pack_sets(ct_sets.values, tfs)
+    pvals, chunk = [], []
+    is_partial = False
+    for pss in sss:
+        if ((max_states is not None) and (len(pvals) * chunk_size + len(chunk) >= max_states)) or \
+           ((deadline is not None) and (time.time() > deadline)):
+            is_partial = True
+            break
+        chunk.append({k for k in pss if pss[k]})
+        if len(chunk) == chunk_size:
+            pvals.append(compute_fisher(pack_sets(chunk, tfs), ct_bits, len(tfs)))
+            chunk = []
+    # The stream also ends early when the solvers are killed at deadline
+    if (deadline is not None) and (time.time() > deadline):
+        is_partial = True
+    if len(chunk) > 0:
+        pvals.append(compute_fisher(pack_sets(chunk, tfs), ct_bits, len(tfs)))
+    if len(pvals) > 0:
+        pvals = np.vstack(pvals)
+    else:
+        pvals = np.zeros((0, ct_sets.shape[0]))
     pvals = scs.false_discovery_control(pvals, axis=1)
     df = pd.DataFrame(pvals < thr_pval, columns=ct_sets.index)
-    return df
+    return df, is_partial
 
 
 def get_prc_rcl(hits):
@@ -79,7 +174,9 @@ def get_prc_rcl(hits):
     return prc, rcl
 
 
-def compute_score(grn, ct_df, thr_pval=0.01):
+def compute_score(grn, ct_df, thr_pval=0.01, max_states=100_000, max_time=None):
+    # Wall clock budget of the whole search, primes included
+    deadline = None if max_time is None else time.time() + max_time
     # Find ct sets
     ct_sets = ct_df.groupby('celltype')['tf'].apply(lambda x: set(x))
     # Filter for tfs
@@ -90,34 +187,70 @@ def compute_score(grn, ct_df, thr_pval=0.01):
         rules = define_bool_rules(sgrn)
         print(rules)
         print('Generating primes ...')
-        primes = file_exchange.bnet2primes(rules)
+        primes = bnet2primes(rules, deadline=deadline)
+        if primes is None:
+            print('Time limit reached while generating primes')
+            return np.nan, np.nan, np.nan, True
         print('Primes generated')
         print('Computing steady states ...')
-        sss = trap_spaces.compute_steady_states(primes, max_output=int(100_000))
-        hits = find_hits(sss, ct_sets, tfs, thr_pval)
-        print('Done')
+        # Ask for one more state to know whether max_states truncated them
+        sss = iter_steady_states(primes, max_output=max_states + 1, deadline=deadline)
+        hits, is_partial = find_hits(sss, ct_sets, tfs, thr_pval, max_states=max_states, deadline=deadline)
+        sss.close()
+        print('Done, {0} steady states{1}'.format(hits.shape[0], ' (partial)' if is_partial else ''))
         prc, rcl = get_prc_rcl(hits)
         f01 = f_beta_score(prc, rcl)
-        return prc, rcl, f01
+        return prc, rcl, f01, is_partial
     else:
-        return np.nan, np.nan, np.nan
+        return np.nan, np.nan, np.nan, False
+
+
+def prepare(grn_paths, path_tfs, thr_pval=0.01, max_states=100_000, max_time='None'):
+    ct_df = pd.read_csv(path_tfs)
+    max_time = None if max_time in [None, 'None'] else float(max_time)
+    return dict(ct_df=ct_df, thr_pval=float(thr_pval), max_states=int(max_states), max_time=max_time)
 
 
-path_grn = sys.argv[1]
-path_tfs = sys.argv[2]
-thr_pval = float(sys.argv[3])
-path_out = sys.argv[4]
+def evaluate(grn_path, ctx):
+    grn_name = get_grn_info(grn_path)[0]
+
+    # Load data
+    grn = read_grn(grn_path, columns=['source', 'target', 'score'], dedup=True)
+
+    # Compute score
+    prc, rcl, f01, is_partial = compute_score(
+        grn,
+        ctx['ct_df'],
+        thr_pval=ctx['thr_pval'],
+        max_states=ctx['max_states'],
+        max_time=ctx['max_time'],
+    )
+
+    # Transform to df
+    df = pd.DataFrame([[grn_name, prc, rcl, f01, is_partial]], columns=['name', 'prc', 'rcl', 'f01', 'partial'])
+    return df
+
 
-# Load data
-grn_name = os.path.basename(path_grn).replace('.grn.csv', '')
-grn = pd.read_csv(path_grn).drop_duplicates(['source', 'target'])
-ct_df = pd.read_csv(path_tfs)
+if __name__ == '__main__':
+    # Init args
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i','--path_grn', required=True)
+    parser.add_argument('-t','--path_tfs', required=True)
+    parser.add_argument('-p','--thr_pval', required=False, type=float, default=0.01)
+    parser.add_argument('-s','--max_states', required=False, type=int, default=100_000)
+    parser.add_argument('-m','--max_time', required=False, default='None')
+    parser.add_argument('-o','--path_out', required=True)
+    args = vars(parser.parse_args())
 
-# Compute score
-prc, rcl, f01 = compute_score(grn, ct_df)
+    path_grn = args['path_grn']
+    path_tfs = args['path_tfs']
+    thr_pval = args['thr_pval']
+    max_states = args['max_states']
+    max_time = args['max_time']
+    path_out = args['path_out']
 
-# Transform to df
-df = pd.DataFrame([[grn_name, prc, rcl, f01]], columns=['name', 'prc', 'rcl', 'f01'])
+    ctx = prepare([path_grn], path_tfs=path_tfs, thr_pval=thr_pval, max_states=max_states, max_time=max_time)
+    df = run_evaluate(evaluate, path_grn, ctx)
 
-# Write
-df.to_csv(path_out, index=False)
+    # Write
+    df.to_csv(path_out, index=False)
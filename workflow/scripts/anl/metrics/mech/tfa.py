@@ -1,87 +1,100 @@
 import pandas as pd
 import numpy as np
 import decoupler as dc
-import mudata as mu
+import scipy.stats as ss
 import sys
 import os
-import re
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from utils import load_cats, f_beta_score
+from utils import f_beta_score, read_grn, get_grn_info, get_case_info, load_knocktf, run_evaluate
 import argparse
 
 
-# Init args
-parser = argparse.ArgumentParser()
-parser.add_argument('-i','--grn_path', required=True)
-parser.add_argument('-b','--bnc_path', required=True)
-parser.add_argument('-o','--out_path', required=True)
-args = vars(parser.parse_args())
-
-grn_path = args['grn_path']
-bnc_path = args['bnc_path']
-out_path = args['out_path']
-
-# Extract names and path
-grn_name = os.path.basename(grn_path).replace('.grn.csv', '')
-data_path = os.path.join(os.path.dirname(os.path.dirname(grn_path)), 'mdata.h5mu')
-dataset = os.path.basename(os.path.dirname(os.path.dirname(os.path.dirname(data_path))))
-case = os.path.basename(os.path.dirname(data_path))
-rsc_name = os.path.basename(bnc_path)
-
-# Read GRN
-grn = pd.read_csv(grn_path)
-grn = grn.drop_duplicates(['source', 'target'], keep='first')
-
-if grn.shape[0] > 0:
-    # Read dataset
-    rna = mu.read(os.path.join(data_path, 'mod', 'rna'))
-
-    # Read benchmark data
-    mat = pd.read_csv(os.path.join(bnc_path, 'diff.csv'), index_col=0)
-    obs = pd.read_csv(os.path.join(bnc_path, 'meta.csv'), index_col=0)
-    
-    # Subset bench data to dataset
-    cats = load_cats(dataset, case)
-    cats = [re.escape(c) for c in cats[rsc_name]]
-    msk = obs['Tissue.Type'].isin(cats) & obs['TF'].isin(rna.var_names) & (obs['logFC'] < -0.5)
-    obs = obs.loc[msk, :]
-    mat = mat.loc[msk, :]
-
-    # Compute TF activities
-    acts = []
-    pvals = []
-    for dataset in obs.index:
-        tf = obs.loc[dataset, 'TF']
-        tf_mat = mat.loc[[dataset], :]
-        tf_grn = grn[grn['source'] == tf]
-        try:
-            act, pval = dc.run_ulm(
-                mat=tf_mat,
-                net=tf_grn,
-                weight='score',
-                min_n=3,
-            )
-            act, pval = act.values[0, 0], pval.values[0, 0]
-            acts.append(act)
-            pvals.append(pval)
-        except:
-            pass
-
-    # Compute recall
-    acts = np.array(acts)
-    pvals = np.array(pvals)
-    padj = dc.p_adjust_fdr(pvals)
-    tp = np.sum((acts < 0) & (padj < 0.05))
-    if tp > 0:
-        prc = tp / acts.size
-        rcl = tp / obs.shape[0]
-        f01 = f_beta_score(prc, rcl)
+def run_ulm_exps(mat, tfs, grn, min_n=3):
+    """Fit dc.run_ulm for each experiment (row of mat) against the regulon of its TF
+    in a single pass. Experiments dc.run_ulm would fail on are skipped"""
+    # Regulon weights of the knocked down TFs, genes x tfs
+    genes = mat.columns.values.astype('U')
+    u_tfs, tf_idx = np.unique(np.asarray(tfs).astype('U'), return_inverse=True)
+    net = grn[np.isin(grn['source'].values.astype('U'), u_tfs) & np.isin(grn['target'].values.astype('U'), genes)]
+    rows = pd.Index(genes).get_indexer(net['target'].values.astype('U'))
+    cols = pd.Index(u_tfs).get_indexer(net['source'].values.astype('U'))
+    w = np.zeros((genes.size, u_tfs.size), dtype=np.float32)
+    w[rows, cols] = np.nan_to_num(net['score'].values.astype(np.float32))
+    is_trg = np.zeros((genes.size, u_tfs.size), dtype=bool)
+    is_trg[rows, cols] = True
+
+    # Features of each experiment are its non-zero genes, which need min_n targets
+    x = mat.values.astype(np.float32)
+    msk = x != 0
+    n = msk.sum(1)
+    n_trg = (msk & is_trg[:, tf_idx].T).sum(1)
+    is_valid = (n > 0) & np.isfinite(x).all(1) & (n_trg >= min_n)
+    x, w, msk, n = x[is_valid], w[:, tf_idx[is_valid]].T, msk[is_valid], n[is_valid].astype(np.float32)
+
+    # Pearson correlation over the features and its t-value
+    x_c = np.where(msk, x - (x.sum(1) / n)[:, None], 0.)
+    w_c = np.where(msk, w - (np.where(msk, w, 0.).sum(1) / n)[:, None], 0.)
+    cov = (x_c * w_c).sum(1) / (n - 1)
+    ssd = np.sqrt((x_c ** 2).sum(1) / (n - 1)) * np.sqrt((w_c ** 2).sum(1) / (n - 1))
+    r = cov / ssd
+    df = n - 2
+    acts = r * np.sqrt(df / ((1.0 - r + 1.0e-16) * (1.0 + r + 1.0e-16)))
+    pvals = ss.t.sf(np.abs(acts), df) * 2
+    return acts, pvals
+
+
+def prepare(grn_paths, bnc_path):
+    data_path, dataset, case = get_case_info(grn_paths)
+
+    # Read benchmark data subset to dataset
+    obs, mat = load_knocktf(bnc_path, data_path, dataset, case)
+    return dict(obs=obs, mat=mat)
+
+
+def evaluate(grn_path, ctx):
+    grn_name = get_grn_info(grn_path)[0]
+    obs, mat = ctx['obs'], ctx['mat']
+
+    # Read GRN
+    grn = read_grn(grn_path, columns=['source', 'target', 'score'], dedup=True)
+
+    if grn.shape[0] > 0:
+        # Compute TF activities
+        acts, pvals = run_ulm_exps(mat, obs['TF'].values, grn, min_n=3)
+
+        # Compute recall
+        acts = np.array(acts)
+        pvals = np.array(pvals)
+        padj = dc.p_adjust_fdr(pvals)
+        tp = np.sum((acts < 0) & (padj < 0.05))
+        if tp > 0:
+            prc = tp / acts.size
+            rcl = tp / obs.shape[0]
+            f01 = f_beta_score(prc, rcl)
+        else:
+            prc, rcl, f01 = 0., 0., 0.
+
+        df = pd.DataFrame([[grn_name, prc, rcl, f01]], columns=['name', 'prc', 'rcl', 'f01'])
     else:
-        prc, rcl, f01 = 0., 0., 0.
+        df = pd.DataFrame([[grn_name, np.nan, np.nan, np.nan]], columns=['name', 'prc', 'rcl', 'f01'])
+    return df
+
+
+if __name__ == '__main__':
+    # Init args
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i','--grn_path', required=True)
+    parser.add_argument('-b','--bnc_path', required=True)
+    parser.add_argument('-o','--out_path', required=True)
+    args = vars(parser.parse_args())
+
+    grn_path = args['grn_path']
+    bnc_path = args['bnc_path']
+    out_path = args['out_path']
 
-    df = pd.DataFrame([[grn_name, prc, rcl, f01]], columns=['name', 'prc', 'rcl', 'f01'])
-else:
-    df = pd.DataFrame([[grn_name, np.nan, np.nan, np.nan]], columns=['name', 'prc', 'rcl', 'f01'])
+    # Evaluate
+    ctx = prepare([grn_path], bnc_path=bnc_path)
+    df = run_evaluate(evaluate, grn_path, ctx)
 
-# Write
-df.to_csv(out_path, index=False)
+    # Write
+    df.to_csv(out_path, index=False)
@@ -1,40 +1,68 @@
 import pandas as pd
 import numpy as np
+import scipy.sparse as sps
 import mudata as mu
 import decoupler as dc
 import argparse
 import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from utils import f_beta_score
-
-
-# Init args
-parser = argparse.ArgumentParser()
-parser.add_argument('-i','--grn_path', required=True)
-parser.add_argument('-p','--ptw_path', required=True)
-parser.add_argument('-o','--out_path', required=True)
-args = vars(parser.parse_args())
-
-grn_path = args['grn_path']
-ptw_path = args['ptw_path']
-out_path = args['out_path']
-
-grn_name = os.path.basename(grn_path).replace('.grn.csv', '')
-data_path = os.path.join(os.path.dirname(os.path.dirname(grn_path)), 'mdata.h5mu')
-
-grn = pd.read_csv(grn_path)
-
-def get_sig_pws(grn, db, thr_pval):
-    sig_pws = set()
-    for tf in grn['source'].unique():
-        df = grn[grn['source'] == tf].set_index('target')
-        pws = dc.get_ora_df(
-            df=df,
-            net=db,
-        )
-        sig_pws.update(pws[pws['FDR p-value'] < thr_pval]['Term'])
-    sig_pws = np.array(list(sig_pws))
+from utils import f_beta_score, read_grn, get_grn_info, get_case_info, fisher_sf, get_cache_path, write_npz, hash_file, run_evaluate
+
+
+def get_incidence(rows, cols, n_rows, n_cols):
+    """Binary sparse matrix from (row, col) pairs, duplicates counted once"""
+    mat = sps.csr_matrix((np.ones(rows.size, dtype=np.int64), (rows, cols)), shape=(n_rows, n_cols))
+    mat.sum_duplicates()
+    mat.data[:] = 1
+    return mat
+
+
+def get_db_incidence(db):
+    """Gene x pathway incidence of a gene set db"""
+    gns, genes = pd.factorize(db['target'].values.astype('U'))
+    pws, terms = pd.factorize(db['source'].values.astype('U'))
+    mat = get_incidence(gns, pws, genes.size, terms.size).tocsc()
+    return dict(genes=pd.Index(genes), terms=np.asarray(terms), mat=mat)
+
+
+def fdr_by_row(rows, pvals):
+    """Benjamini-Hochberg correction of the p-values of each row"""
+    order = np.lexsort((-pvals, rows))
+    rows, pvals = rows[order], pvals[order]
+    n = np.bincount(rows)[rows]
+    # Rank within row in ascending p-value order
+    starts = np.searchsorted(rows, rows, side='left')
+    rank = n - (np.arange(rows.size) - starts)
+    q = pd.Series(pvals * n / rank).groupby(rows).cummin().values
+    fdr = np.empty_like(q)
+    fdr[order] = np.minimum(q, 1.)
+    return fdr
+
+
+def get_sig_pws(grn, db, thr_pval, n_background=20000):
+    """Pathways enriched (one-sided Fisher, FDR per TF) in the targets of any TF,
+    as dc.get_ora_df per TF but from a single TF x pathway overlap product"""
+    grn = grn.drop_duplicates(['source', 'target'])
+    tfs, tf_names = pd.factorize(grn['source'].values.astype('U'))
+    trg = db['genes'].get_indexer(grn['target'].values.astype('U'))
+    n_trg = np.bincount(tfs, minlength=tf_names.size)
+    msk = trg >= 0
+    x = get_incidence(tfs[msk], trg[msk], tf_names.size, db['genes'].size)
+    mat = db['mat']
+    sizes = np.asarray(mat.sum(0)).ravel()
+    inter = (x @ mat).tocoo()
+    rows, cols, a = inter.row, inter.col, inter.data
+    msk = a > 0
+    rows, cols, a = rows[msk], cols[msk], a[msk]
+    pvals = fisher_sf(a, sizes[cols], n_trg[rows], n_background)
+    # Cover limit float with the smallest non-zero p-value of each TF
+    zero = pvals == 0.
+    if zero.any():
+        min_p = pd.Series(np.where(zero, np.inf, pvals)).groupby(rows).transform('min').values
+        pvals[zero] = np.where(np.isfinite(min_p[zero]), min_p[zero], 1.)
+    fdr = fdr_by_row(rows, pvals)
+    sig_pws = np.unique(db['terms'][cols[fdr < thr_pval]])
     return sig_pws
 
 
@@ -51,8 +79,7 @@ def eval_metrics(y_pred, y):
     return prc, rcl, f1
 
 
-def eval_grn(data, grn, db, thr_pval=0.01, thr_prop=0.2):
-    hits = get_pw_hits(data, thr_pval, thr_prop)
+def eval_grn(hits, grn, db, thr_pval=0.01):
     sig_pws = get_sig_pws(grn, db, thr_pval)
     prc, rcl, f1 = eval_metrics(y_pred=sig_pws, y=hits)
     return prc, rcl, f1
@@ -67,7 +94,17 @@ def get_pw_hits(data, thr_pval, thr_prop):
     return hits
 
 
-if grn.shape[0] > 0:
+def load_pw_hits(data_path, ptw_path, thr_pval=0.01, thr_prop=0.2):
+    """Pathway hits of a case for a gene set db, cached per case and keyed by
+    the db content hash, the mdata size and mtime and the thresholds"""
+    db_name = os.path.basename(ptw_path).replace('.csv', '')
+    cache_path = get_cache_path(data_path, 'gsets.{0}.npz'.format(db_name))
+    stat = os.stat(data_path)
+    key = '{0}|{1}|{2}|{3}|{4}'.format(hash_file(ptw_path), stat.st_size, stat.st_mtime_ns, thr_pval, thr_prop)
+    if os.path.isfile(cache_path):
+        cache = np.load(cache_path)
+        if str(cache['key']) == key:
+            return cache['hits']
     ptw = pd.read_csv(ptw_path)
     rna = mu.read(os.path.join(data_path, 'mod', 'rna'))
     # Infer pathway activities
@@ -78,10 +115,44 @@ if grn.shape[0] > 0:
         use_raw=False,
         verbose=True
     )
-    prc, rcl, f01 = eval_grn(rna, grn, ptw, thr_pval=0.01, thr_prop=0.2)
-    df = pd.DataFrame([[grn_name, prc, rcl, f01]], columns=['name', 'prc', 'rcl', 'f01'])
-else:
-    df = pd.DataFrame([[grn_name, np.nan, np.nan, np.nan]], columns=['name', 'prc', 'rcl', 'f01'])
+    hits = get_pw_hits(rna, thr_pval=thr_pval, thr_prop=thr_prop)
+    write_npz(cache_path, key=np.array(key), hits=hits)
+    return hits
+
+
+def prepare(grn_paths, ptw_path):
+    data_path, _, _ = get_case_info(grn_paths)
+    ptw = pd.read_csv(ptw_path)
+    hits = load_pw_hits(data_path, ptw_path, thr_pval=0.01, thr_prop=0.2)
+    return dict(ptw=get_db_incidence(ptw), hits=hits)
+
+
+def evaluate(grn_path, ctx):
+    grn_name = get_grn_info(grn_path)[0]
+    grn = read_grn(grn_path, columns=['source', 'target'])
+    if grn.shape[0] > 0:
+        prc, rcl, f01 = eval_grn(ctx['hits'], grn, ctx['ptw'], thr_pval=0.01)
+        df = pd.DataFrame([[grn_name, prc, rcl, f01]], columns=['name', 'prc', 'rcl', 'f01'])
+    else:
+        df = pd.DataFrame([[grn_name, np.nan, np.nan, np.nan]], columns=['name', 'prc', 'rcl', 'f01'])
+    return df
+
+
+if __name__ == '__main__':
+    # Init args
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i','--grn_path', required=True)
+    parser.add_argument('-p','--ptw_path', required=True)
+    parser.add_argument('-o','--out_path', required=True)
+    args = vars(parser.parse_args())
+
+    grn_path = args['grn_path']
+    ptw_path = args['ptw_path']
+    out_path = args['out_path']
+
+    # Evaluate
+    ctx = prepare([grn_path], ptw_path=ptw_path)
+    df = run_evaluate(evaluate, grn_path, ctx)
 
-# Write
-df.to_csv(out_path, index=False)
+    # Write
+    df.to_csv(out_path, index=False)
@@ -5,83 +5,132 @@ from sklearn.model_selection import train_test_split
 from xgboost import XGBRegressor
 from tqdm import tqdm
 import scipy
+import scipy.sparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import argparse
 import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from utils import f_beta_score
+from utils import f_beta_score, read_grn, get_grn_info, get_case_info, run_evaluate
 
 
-# Init args
-parser = argparse.ArgumentParser()
-parser.add_argument('-a','--grn_path', required=True)
-parser.add_argument('-b','--col_source', required=True)
-parser.add_argument('-c','--col_target', required=True)
-parser.add_argument('-d','--mod_source', required=True)
-parser.add_argument('-e','--mod_target', required=True)
-parser.add_argument('-f','--out_path', required=True)
-args = vars(parser.parse_args())
+def materialize(adata, train, test):
+    """Train and test splits of adata as float32 csc matrices, to slice features by position"""
+    obs_names = adata.obs_names
+    mats = dict(var_names=adata.var_names)
+    for name, obs in [('train', train), ('test', test)]:
+        X = adata.X[obs_names.get_indexer(obs), :]
+        mats[name] = scipy.sparse.csc_matrix(X, dtype=np.float32)
+    return mats
 
-grn_path = args['grn_path']
-col_source = args['col_source']
-col_target = args['col_target']
-mod_source = args['mod_source']
-mod_target = args['mod_target']
-out_path = args['out_path']
 
-grn_name = os.path.basename(grn_path).replace('.grn.csv', '')
-data_path = os.path.join(os.path.dirname(os.path.dirname(grn_path)), 'mdata.h5mu')
+# Materialized modalities of the dataset, inherited by forked workers
+mats = None
 
-grn = pd.read_csv(grn_path)
 
-def test_predictability(mdata, train, test, grn, col_source='source', col_target='target', mod_source='rna', mod_target='rna', ntop=5):
-    def remove_zeros(X, y):
+def fit_target(task):
+    """Fit sources to target and correlate the predictions on the test split"""
+    target, trg_idx, src_idx, mod_source, mod_target, nthread = task
+    res = []
+    for split in ['train', 'test']:
+        X = mats[mod_source][split][:, src_idx].toarray()
+        y = mats[mod_target][split][:, trg_idx].toarray().ravel()
         msk = y != 0.
-        y = y[msk]
-        X = X[msk, :]
-        return X, y
+        res.append((X[msk, :], y[msk]))
+    (train_X, train_y), (test_X, test_y) = res
+    if test_y.size >= 10:
+        reg = XGBRegressor(random_state=0, n_jobs=nthread).fit(train_X, train_y)
+        pred_y = reg.predict(test_X)
+        if np.any(pred_y != pred_y[0]):
+            s, p = scipy.stats.spearmanr(pred_y, test_y)  # Spearman to control for outliers
+            return [target, pred_y.size, len(src_idx), s, p]
+    return None
+
+
+def test_predictability(grn, col_source='source', col_target='target', mod_source='rna', mod_target='rna', ntop=5, n_jobs=1, nthread=1):
     net = grn.iloc[np.argsort(-abs(grn['score'])), :].drop_duplicates([col_source, col_target])
     net = net.groupby(col_target)[col_source].apply(lambda x: list(x) if ntop is None else list(x)[:ntop])
-    cor = []
-    for target in tqdm(net.index):
+    tasks = []
+    for target in net.index:
         sources = net[target]
-        sources = [s for s in sources if s != target]
-        if len(sources) > 0:
-            train_X = mdata.mod[mod_source][train, sources].X
-            train_y = mdata.mod[mod_target][train, target].X.ravel()
-            test_X = mdata.mod[mod_source][test, sources].X
-            test_y = mdata.mod[mod_target][test, target].X.ravel()
-            train_X, train_y = remove_zeros(train_X, train_y)
-            test_X, test_y = remove_zeros(test_X, test_y)
-            if test_y.size >= 10:
-                reg = XGBRegressor(random_state=0).fit(train_X, train_y)
-                pred_y = reg.predict(test_X)
-                if np.any(pred_y != pred_y[0]):
-                    s, p = scipy.stats.spearmanr(pred_y, test_y)  # Spearman to control for outliers
-                    cor.append([target, pred_y.size, len(sources), s, p])
-    cor = pd.DataFrame(cor, columns=['target', 'n_obs', 'n_vars', 'coef', 'pval'])
+        sources = [s for s in sources if (s != target) and (s in mats[mod_source]['var_names'])]
+        if (len(sources) > 0) and (target in mats[mod_target]['var_names']):
+            src_idx = mats[mod_source]['var_names'].get_indexer(sources)
+            trg_idx = mats[mod_target]['var_names'].get_loc(target)
+            tasks.append((target, trg_idx, src_idx, mod_source, mod_target, nthread))
+    if n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context('fork')) as pool:
+            cor = list(tqdm(pool.map(fit_target, tasks, chunksize=16), total=len(tasks)))
+    else:
+        cor = [fit_target(task) for task in tqdm(tasks)]
+    cor = pd.DataFrame([c for c in cor if c is not None], columns=['target', 'n_obs', 'n_vars', 'coef', 'pval'])
     if cor.shape[0] > 0:
         cor['padj'] = scipy.stats.false_discovery_control(cor['pval'], method='bh')
     else:
         cor['padj'] = pd.Series(dtype=float)
     return cor
 
-if grn.shape[0] > 0:
+
+def prepare(grn_paths, col_source, col_target, mod_source, mod_target, n_jobs=1, nthread=1):
+    global mats
+    data_path, _, _ = get_case_info(grn_paths)
     mdata = mu.read_h5mu(data_path)
     train, test = train_test_split(mdata.obs_names, test_size=0.33, random_state=42, stratify=mdata.obs['celltype'])
-    cor = test_predictability(mdata=mdata, train=train, test=test, grn=grn)
-    sig_cor = cor[(cor['padj'] < 0.05) & (cor['coef'] > 0.05)]
-    n_hits = sig_cor.shape[0]
-    if n_hits > 0:
-        universe_size = mdata.mod[mod_target].var_names.size
-        rcl = n_hits / universe_size
-        prc = n_hits / cor.shape[0]
-        f01 = f_beta_score(prc, rcl)
+    # Slice the splits once for all targets and grns
+    mats = {mod: materialize(mdata.mod[mod], train, test) for mod in set([mod_source, mod_target])}
+    return dict(mats=mats, col_source=col_source, col_target=col_target,
+                mod_source=mod_source, mod_target=mod_target, n_jobs=int(n_jobs), nthread=int(nthread))
+
+
+def evaluate(grn_path, ctx):
+    grn_name = get_grn_info(grn_path)[0]
+    mod_target = ctx['mod_target']
+    grn = read_grn(grn_path)
+    if grn.shape[0] > 0:
+        cor = test_predictability(grn=grn, n_jobs=ctx['n_jobs'], nthread=ctx['nthread'])
+        sig_cor = cor[(cor['padj'] < 0.05) & (cor['coef'] > 0.05)]
+        n_hits = sig_cor.shape[0]
+        if n_hits > 0:
+            universe_size = ctx['mats'][mod_target]['var_names'].size
+            rcl = n_hits / universe_size
+            prc = n_hits / cor.shape[0]
+            f01 = f_beta_score(prc, rcl)
+        else:
+            prc, rcl, f01 = 0., 0., 0.
+        df = pd.DataFrame([[grn_name, prc, rcl, f01]], columns=['name', 'prc', 'rcl', 'f01'])
     else:
-        prc, rcl, f01 = 0., 0., 0.
-    df = pd.DataFrame([[grn_name, prc, rcl, f01]], columns=['name', 'prc', 'rcl', 'f01'])
-else:
-    df = pd.DataFrame([[grn_name, np.nan, np.nan, np.nan]], columns=['name', 'prc', 'rcl', 'f01'])
+        df = pd.DataFrame([[grn_name, np.nan, np.nan, np.nan]], columns=['name', 'prc', 'rcl', 'f01'])
+    return df
+
+
+if __name__ == '__main__':
+    # Init args
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-a','--grn_path', required=True)
+    parser.add_argument('-b','--col_source', required=True)
+    parser.add_argument('-c','--col_target', required=True)
+    parser.add_argument('-d','--mod_source', required=True)
+    parser.add_argument('-e','--mod_target', required=True)
+    parser.add_argument('-f','--out_path', required=True)
+    parser.add_argument('-n','--n_jobs', required=False, type=int, default=1)
+    parser.add_argument('-t','--nthread', required=False, type=int, default=1)
+    args = vars(parser.parse_args())
+
+    grn_path = args['grn_path']
+    out_path = args['out_path']
+
+    # Evaluate
+    ctx = prepare(
+        [grn_path],
+        col_source=args['col_source'],
+        col_target=args['col_target'],
+        mod_source=args['mod_source'],
+        mod_target=args['mod_target'],
+        n_jobs=args['n_jobs'],
+        nthread=args['nthread'],
+    )
+    df = run_evaluate(evaluate, grn_path, ctx)
 
-# Write
-df.to_csv(out_path, index=False)
+    # Write
+    df.to_csv(out_path, index=False)
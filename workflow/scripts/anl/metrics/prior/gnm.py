@@ -1,107 +1,159 @@
 import pandas as pd
 import numpy as np
-import pyranges as pr
-import mudata as mu
-from tqdm import tqdm
 import re
 import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from utils import load_cats, f_beta_score
+from utils import load_cats, f_beta_score, read_grn, get_grn_info, get_case_info, get_cache_path, is_cached, write_npz, get_names, run_evaluate
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+from coords import parse_cres, get_case_cres
 import argparse
 
 
-# Init args
-parser = argparse.ArgumentParser()
-parser.add_argument('-a','--grn_path', required=True)
-parser.add_argument('-b','--resource_path', required=True)
-parser.add_argument('-d','--grp', default='None')
-parser.add_argument('-f','--out_path', required=True)
-args = vars(parser.parse_args())
-
-grn_path = args['grn_path']
-resource_path = args['resource_path']
-grp = args['grp']
-out_path = args['out_path']
-
-if grp == 'None':
-    grp = None
-
-grn_name = os.path.basename(grn_path).replace('.grn.csv', '')
-data_path = os.path.join(os.path.dirname(os.path.dirname(grn_path)), 'mdata.h5mu')
-dataset = os.path.basename(os.path.dirname(os.path.dirname(os.path.dirname(data_path))))
-case = os.path.basename(os.path.dirname(data_path))
-resource_name = os.path.basename(resource_path).replace('.bed', '')
-
-def read_grn(grn_path, grp=None):
-    grn = pd.read_csv(grn_path)
-    if 'cre' in grn.columns:
-        if grn.shape[0] > 0:
-            grn[['Chromosome', 'Start', 'End']] = grn['cre'].str.split('-', n=2, expand=True)
-            if grp is not None:
-                grn = grn[['Chromosome', 'Start', 'End', grp]].rename(columns={grp: 'Name'})
+def read_bed(resource_path):
+    """Read a bed resource as arrays sorted by chromosome and start, cached next to the bed"""
+    idx_path = re.sub(r'\.bed$', '', resource_path) + '.idx.npz'
+    if not is_cached(idx_path, [resource_path]):
+        with open(resource_path) as f:
+            skiprows = 1 if f.readline().startswith('track') else 0
+        bed = pd.read_csv(resource_path, sep='\t', header=None, skiprows=skiprows, dtype={0: str, 3: str, 4: str})
+        bed = dict(
+            Chromosome=bed[0].values.astype('U'),
+            Start=bed[1].values.astype(np.int64),
+            End=bed[2].values.astype(np.int64),
+            Name=bed[3].values.astype('U') if bed.shape[1] > 3 else np.full(bed.shape[0], ''),
+            Score=bed[4].values.astype('U') if bed.shape[1] > 4 else np.full(bed.shape[0], ''),
+        )
+        order = np.lexsort((bed['Start'], bed['Chromosome']))
+        write_npz(idx_path, **{c: bed[c][order] for c in bed})
+    bed = np.load(idx_path)
+    return {c: bed[c] for c in bed.files}
+
+
+def count_overlaps(q_key, q_start, q_end, s_key, s_start, s_end):
+    """Number of subject intervals overlapping each query interval sharing its key"""
+    # Intervals are half open, keys are packed with coordinates into single sorted int64s
+    s_starts = np.sort((s_key.astype(np.int64) << 32) | s_start)
+    s_ends = np.sort((s_key.astype(np.int64) << 32) | s_end)
+    q_key = q_key.astype(np.int64) << 32
+    n_starts = np.searchsorted(s_starts, q_key | q_end, side='left')
+    n_ends = np.searchsorted(s_ends, q_key | q_start, side='right')
+    return n_starts - n_ends
+
+
+def prepare(grn_paths, resource_path, grp='None'):
+    data_path, dataset, case = get_case_info(grn_paths)
+    resource_name = os.path.basename(resource_path).replace('.bed', '')
+    if grp == 'None':
+        grp = None
+
+    # Filtered resource is reused across all grns of the case
+    cache_path = get_cache_path(data_path, 'gnm.{0}.{1}.npz'.format(resource_name, grp))
+    if not is_cached(cache_path, [resource_path, data_path, 'config/prior_cats.json']):
+        # Read resource and filter by cats
+        db = read_bed(resource_path)
+        cats = load_cats(dataset, case)
+        msk = np.ones(db['Start'].size, dtype=bool)
+        if resource_name in cats:
+            cats = [re.escape(c) for c in cats[resource_name]]
+            print('Filtering for {0} cats'.format(len(cats)))
+            msk &= pd.Series(db['Score']).str.contains('|'.join(cats)).values
+
+        # Filter genomic resource by measured CREs and or genes
+        p_chr, p_start, p_end = get_case_cres(data_path, 'atac')
+        p_chr = np.asarray(p_chr).astype('U')
+        chrs = pd.Index(np.unique(np.concatenate([db['Chromosome'], p_chr])))
+        db_chr = chrs.get_indexer(db['Chromosome'])
+        p_chr = chrs.get_indexer(p_chr)
+        msk &= count_overlaps(db_chr, db['Start'], db['End'], p_chr, p_start, p_end) > 0
+        if grp is not None:
+            genes = get_names(data_path, 'rna').values
+            msk &= np.isin(db['Name'], genes)
+
+        # Peaks not in the resource, the fns of the blacklist
+        n_free = np.sum(count_overlaps(p_chr, p_start, p_end, db_chr[msk], db['Start'][msk], db['End'][msk]) == 0)
+        write_npz(
+            cache_path,
+            Chromosome=db['Chromosome'][msk],
+            Start=db['Start'][msk],
+            End=db['End'][msk],
+            Name=db['Name'][msk],
+            n_free=np.array(n_free),
+        )
+    db = np.load(cache_path)
+    db = {c: db[c] for c in db.files}
+    return dict(db=db, grp=grp, resource_name=resource_name)
+
+
+def evaluate(grn_path, ctx):
+    grn_name = get_grn_info(grn_path)[0]
+    db, grp, resource_name = ctx['db'], ctx['grp'], ctx['resource_name']
+
+    grn = read_grn(grn_path, columns=['cre'] if grp is None else ['cre', grp])
+
+    if ('cre' in grn.columns) and (grn.shape[0] > 0):
+        chrs = pd.Index(np.unique(db['Chromosome']))
+        db_chr = chrs.get_indexer(db['Chromosome'])
+        cres, cre_idx = pd.factorize(grn['cre'].values)
+        g_chr, g_start, g_end = parse_cres(cre_idx)
+        g_chr = np.asarray(g_chr).astype('U')
+        g_chr, g_start, g_end = chrs.get_indexer(g_chr)[cres], g_start[cres], g_end[cres]
+        if grp is not None:
+            # Remove features that are in GRN but not in db, match intervals by feature and chromosome
+            feats = pd.Index(np.unique(db['Name']))
+            g_feat = feats.get_indexer(grn[grp].values.astype('U'))
+            msk = g_feat >= 0
+            if msk.sum() > 0:
+                n_chrs = chrs.size + 1
+                g_key = g_feat[msk] * n_chrs + (g_chr[msk] + 1)
+                db_key = feats.get_indexer(db['Name']) * n_chrs + (db_chr + 1)
+                g_hits = count_overlaps(g_key, g_start[msk], g_end[msk], db_key, db['Start'], db['End']) > 0
+                db_hits = count_overlaps(db_key, db['Start'], db['End'], g_key, g_start[msk], g_end[msk]) > 0
+                tps = np.sum(g_hits)
+                fps = np.sum(~g_hits)
+                fns = np.sum(~db_hits)
             else:
-                grn = grn[['Chromosome', 'Start', 'End']]
+                tps, fps, fns = 0, 0, 0
         else:
-            grn = None
-    else:
-        grn = None
-    return pr.PyRanges(grn)
-
-grn = read_grn(grn_path=grn_path, grp=grp)
-
-if grn.df.shape[0] > 0:
-    # Read resource and filter by cats
-    db = pr.read_bed(resource_path)
-    cats = load_cats(dataset, case)
-    if resource_name in cats:
-        cats = [re.escape(c) for c in cats[resource_name]]
-        print('Filtering for {0} cats'.format(len(cats)))
-        db = db[db.df['Score'].str.contains('|'.join(cats))]
-    
-    # Filter genomic resource by measured CREs and or genes
-    genes = mu.read(os.path.join(data_path, 'mod', 'rna')).var_names.astype('U')
-    peaks = mu.read(os.path.join(data_path, 'mod', 'atac')).var_names.astype('U')
-    peaks = pd.DataFrame(peaks, columns=['cre'])
-    peaks[['Chromosome', 'Start', 'End']] = peaks['cre'].str.split('-', n=2, expand=True)
-    peaks = pr.PyRanges(peaks[['Chromosome', 'Start', 'End']])
-    db = db.overlap(peaks)
-    
-    if grp is not None:
-        # Remove features that are in GRN but not in db
-        db = db[db.df.Name.astype('U').isin(genes)]
-        grn_feats = grn.df['Name'].unique()
-        db_feats = db.df['Name'].unique()
-        features = np.setdiff1d(grn_feats, db_feats)
-        grn = grn[~grn.df['Name'].isin(features)]
-    
-        tps = 0
-        fps = 0
-        fns = 0
-        if grn.df.shape[0] > 0:
-            for feature in db_feats:
-                f_grn = grn[grn.df['Name'] == feature]
-                f_db = db[db.df['Name'] == feature]
-                tps += f_grn.overlap(f_db).df.shape[0]
-                fps += f_grn.overlap(f_db, invert=True).df.shape[0]
-                fns += f_db.overlap(f_grn, invert=True).df.shape[0]
-    elif resource_name != 'blacklist':
-        tps = grn.overlap(db).df.shape[0]
-        fps = grn.overlap(db, invert=True).df.shape[0]
-        fns = db.overlap(grn, invert=True).df.shape[0]
-    else:
-        tps = grn.overlap(db, invert=True).df.shape[0]
-        fps = grn.overlap(db).df.shape[0]
-        fns = peaks.overlap(db, invert=True).df.shape[0]
-    if tps > 0:
-        prc = tps / (tps + fps)
-        rcl = tps / (tps + fns)
-        f01 = f_beta_score(prc, rcl)
+            g_hits = count_overlaps(g_chr, g_start, g_end, db_chr, db['Start'], db['End']) > 0
+            if resource_name != 'blacklist':
+                db_hits = count_overlaps(db_chr, db['Start'], db['End'], g_chr, g_start, g_end) > 0
+                tps = np.sum(g_hits)
+                fps = np.sum(~g_hits)
+                fns = np.sum(~db_hits)
+            else:
+                tps = np.sum(~g_hits)
+                fps = np.sum(g_hits)
+                fns = int(db['n_free'])
+        if tps > 0:
+            prc = tps / (tps + fps)
+            rcl = tps / (tps + fns)
+            f01 = f_beta_score(prc, rcl)
+        else:
+            prc, rcl, f01 = 0., 0., 0.
+        df = pd.DataFrame([[grn_name, prc, rcl, f01]], columns=['name', 'prc', 'rcl', 'f01'])
     else:
-        prc, rcl, f01 = 0., 0., 0.
-    df = pd.DataFrame([[grn_name, prc, rcl, f01]], columns=['name', 'prc', 'rcl', 'f01'])
-else:
-    df = pd.DataFrame([[grn_name, np.nan, np.nan, np.nan]], columns=['name', 'prc', 'rcl', 'f01'])
+        df = pd.DataFrame([[grn_name, np.nan, np.nan, np.nan]], columns=['name', 'prc', 'rcl', 'f01'])
+    return df
+
+
+if __name__ == '__main__':
+    # Init args
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-a','--grn_path', required=True)
+    parser.add_argument('-b','--resource_path', required=True)
+    parser.add_argument('-d','--grp', default='None')
+    parser.add_argument('-f','--out_path', required=True)
+    args = vars(parser.parse_args())
+
+    grn_path = args['grn_path']
+    resource_path = args['resource_path']
+    grp = args['grp']
+    out_path = args['out_path']
+
+    # Evaluate
+    ctx = prepare([grn_path], resource_path=resource_path, grp=grp)
+    df = run_evaluate(evaluate, grn_path, ctx)
 
-# Write
-df.to_csv(out_path, index=False)
+    # Write
+    df.to_csv(out_path, index=False)
@@ -1,34 +1,29 @@
-from itertools import combinations
 import scipy.stats as ss
+import scipy.sparse as sps
 import numpy as np
 import pandas as pd
 import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from utils import f_beta_score
+from utils import f_beta_score, read_grn, get_grn_info, fisher_sf, run_evaluate
 
 
-def compute_pval(tf_a, tf_b, grn):
-    trg_a = set(grn[grn['source'] == tf_a]['target'])
-    trg_b = set(grn[grn['source'] == tf_b]['target'])
-    total = set(grn['target'])
-    a = len(trg_a & trg_b)
-    if a > 0:
-        b = len(trg_a - trg_b)
-        c = len(trg_b - trg_a)
-        d = len(total - (trg_a | trg_b))
-        s, p = ss.fisher_exact([[a, b], [c, d]], alternative='greater')
-    else:
-        s, p = 0, np.nan
-    return s, p
+def compute_pvals(grn):
+    """One-sided Fisher test of target overlap for all pairs of TFs sharing targets"""
+    src, tfs = pd.factorize(grn['source'])
+    trg, trgs = pd.factorize(grn['target'])
+    x = sps.csr_matrix((np.ones(src.size, dtype=np.int64), (src, trg)), shape=(tfs.size, trgs.size))
+    n_trg = np.asarray(x.sum(1)).ravel()
+    # Shared targets of each pair of tfs
+    inter = sps.triu(x @ x.T, k=1).tocoo()
+    i, j, a = inter.row, inter.col, inter.data
+    pvals = fisher_sf(a, n_trg[i], n_trg[j], trgs.size)
+    df = pd.DataFrame({'tf_a': tfs[i], 'tf_b': tfs[j], 'pval': pvals})
+    return df
 
 
 def find_pairs(grn, thr_pval):
-    df = []
-    for tf_a, tf_b in combinations(grn['source'].unique(), r=2):
-        s, p = compute_pval(tf_a, tf_b, grn)
-        df.append([tf_a, tf_b, s, p])
-    df = pd.DataFrame(df, columns=['tf_a', 'tf_b', 'stat', 'pval']).dropna()
+    df = compute_pvals(grn)
     if df.shape[0] > 0:
         df['padj'] = ss.false_discovery_control(df['pval'], method='bh')
         df = df[df['padj'] < thr_pval]
@@ -38,33 +33,46 @@ def find_pairs(grn, thr_pval):
     return pairs
 
 
-# Read
-grn = pd.read_csv(sys.argv[1]).drop_duplicates(['source', 'target'])
-tfp = pd.read_csv(sys.argv[2], sep='\t', header=None)
+def prepare(grn_paths, resource_path, thr_p):
+    tfp = pd.read_csv(resource_path, sep='\t', header=None)
+    tfs = set(tfp[0]) | set(tfp[1])
+    tfp = set(['|'.join(sorted([a, b])) for a, b in zip(tfp[0], tfp[1])])
+    return dict(tfs=tfs, tfp=tfp, thr_p=float(thr_p))
+
+
+def evaluate(grn_path, ctx):
+    tfs, tfp, thr_p = ctx['tfs'], ctx['tfp'], ctx['thr_p']
+
+    # Read
+    grn = read_grn(grn_path, columns=['source', 'target'], dedup=True)
 
-# Process
-tfs = set(tfp[0]) | set(tfp[1])
-grn = grn[grn['source'].isin(tfs)]
-tfp = set(['|'.join(sorted([a, b])) for a, b in zip(tfp[0], tfp[1])])
-grn_name = os.path.basename(sys.argv[1]).replace('.grn.csv', '')
+    # Process
+    grn = grn[grn['source'].isin(tfs)]
+    grn_name = get_grn_info(grn_path)[0]
 
-if grn.shape[0] > 1:  # Need at least 2 TFs in grn
-    # Find pairs
-    p_grn = find_pairs(grn, thr_pval=float(sys.argv[3]))
-    
-    # Compute F score
-    tp = len(p_grn & tfp)
-    if tp > 0:
-        fp = len(p_grn - tfp)
-        fn = len(tfp - p_grn)
-        rcl = tp / (tp + fn)
-        prc = tp / (tp + fp)
-        f01 = f_beta_score(prc, rcl)
+    if grn.shape[0] > 1:  # Need at least 2 TFs in grn
+        # Find pairs
+        p_grn = find_pairs(grn, thr_pval=thr_p)
+
+        # Compute F score
+        tp = len(p_grn & tfp)
+        if tp > 0:
+            fp = len(p_grn - tfp)
+            fn = len(tfp - p_grn)
+            rcl = tp / (tp + fn)
+            prc = tp / (tp + fp)
+            f01 = f_beta_score(prc, rcl)
+        else:
+            prc, rcl, f01 = 0., 0., 0.
+        df = pd.DataFrame([[grn_name, prc, rcl, f01]], columns=['name', 'prc', 'rcl', 'f01'])
     else:
-        prc, rcl, f01 = 0., 0., 0.
-    df = pd.DataFrame([[grn_name, prc, rcl, f01]], columns=['name', 'prc', 'rcl', 'f01'])
-else:
-    df = pd.DataFrame([[grn_name, np.nan, np.nan, np.nan]], columns=['name', 'prc', 'rcl', 'f01'])
+        df = pd.DataFrame([[grn_name, np.nan, np.nan, np.nan]], columns=['name', 'prc', 'rcl', 'f01'])
+    return df
+
+
+if __name__ == '__main__':
+    ctx = prepare([sys.argv[1]], resource_path=sys.argv[2], thr_p=sys.argv[3])
+    df = run_evaluate(evaluate, sys.argv[1], ctx)
 
-# Write
-df.to_csv(sys.argv[4], index=False)
+    # Write
+    df.to_csv(sys.argv[4], index=False)
@@ -0,0 +1,97 @@
+import importlib.util
+import multiprocessing
+import resource
+import signal
+import time
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+import sys
+import os
+import argparse
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from utils import parse_score_path, write_scores, run_evaluate, get_tmp_path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from telemetry import Telemetry
+
+
+# Init args
+parser = argparse.ArgumentParser()
+parser.add_argument('-m','--metric', required=True)
+parser.add_argument('-i','--grn_paths', required=True, nargs='+')
+parser.add_argument('-p','--params', required=False, nargs='*', default=[])
+parser.add_argument('-t','--grn_secs', required=False, type=int, default=0)
+parser.add_argument('-n','--n_jobs', required=False, type=int, default=1)
+parser.add_argument('-l','--tlm_path', required=False, default=None)
+parser.add_argument('-o','--out_path', required=True)
+args = vars(parser.parse_args())
+
+metric = args['metric']
+grn_paths = args['grn_paths']
+params = dict([p.split('=', 1) for p in args['params']])
+grn_secs = args['grn_secs']
+n_jobs = args['n_jobs']
+tlm_path = args['tlm_path']
+out_path = args['out_path']
+
+
+def load_metric(metric):
+    """Import a metric script (e.g. prior/gnm) as a module exposing prepare and evaluate"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), metric + '.py')
+    spec = importlib.util.spec_from_file_location(os.path.basename(metric), path)
+    mdl = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = mdl  # Lets workers pickle functions of the metric
+    spec.loader.exec_module(mdl)
+    return mdl
+
+
+def raise_timeout(signum, frame):
+    raise TimeoutError('grn time limit reached')
+
+
+def run_grn(grn_path):
+    """Score a grn, a grn that fails or exceeds grn_secs (0 for no limit)
+    gets NaN scores and a failed or timeout status instead of failing the
+    whole batch"""
+    # Uses the module level mdl and ctx, inherited by forked workers
+    start = time.perf_counter()
+    signal.signal(signal.SIGALRM, raise_timeout)
+    signal.alarm(grn_secs)
+    try:
+        df = run_evaluate(mdl.evaluate, grn_path, ctx)
+    finally:
+        signal.alarm(0)
+    # Runtime in seconds, and peak rss in MB of the worker so far: a peak over
+    # the grns it scored up to this one, not the memory of this grn alone
+    df['runtime'] = time.perf_counter() - start
+    df['mem'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return df
+
+
+keys = parse_score_path(out_path)
+tlm = Telemetry('metric_batch', wildcards=keys, path=tlm_path)
+
+# Load dataset and resource once for all grns
+with tlm.phase('load'):
+    mdl = load_metric(metric)
+    ctx = mdl.prepare(grn_paths, **params)
+
+# Score grns
+with tlm.phase('compute'):
+    if n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context('fork')) as pool:
+            dfs = list(tqdm(pool.map(run_grn, grn_paths), total=len(grn_paths)))
+    else:
+        dfs = [run_grn(grn_path) for grn_path in tqdm(grn_paths)]
+    df = pd.concat(dfs)
+
+# Write rows to a new scores db, moved in place once complete
+with tlm.phase('write'):
+    tmp_path = get_tmp_path(out_path, suffix='.tmp.db')
+    try:
+        write_scores(tmp_path, df, **keys)
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+tlm.write()
@@ -1,15 +1,20 @@
 import pandas as pd
 import numpy as np
+import scipy.stats as ss
+import concurrent.futures
+from functools import partial
 import argparse
+import sys
 import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from utils import parse_score_path
 
 
 def read_eval(m_path):
-    db_name = os.path.basename(os.path.dirname(m_path))
-    task = os.path.basename(os.path.dirname(os.path.dirname(m_path)))
-    metric = os.path.basename(os.path.dirname(os.path.dirname(os.path.dirname(m_path))))
-    case = os.path.basename(m_path).replace('.scores.csv', '')
-    df = pd.read_csv('anl/metrics/{0}/{1}/{2}/{3}.scores.csv'.format(metric, task, db_name, case)).sort_values('f01', ascending=False)
+    keys = parse_score_path(m_path)
+    metric, task, db_name = keys['metric'], keys['task'], keys['db']
+    case = '{0}.{1}'.format(keys['dts'], keys['case'])
+    df = pd.read_csv(m_path).sort_values('f01', ascending=False)
     df[['pre', 'p2g', 'tfb', 'mdl']] = df['name'].str.split('.', n=4, expand=True)
     df = df[~df['pre'].str.startswith('o_')]
     df = df.reset_index(drop=True).reset_index(names='rank')
@@ -17,44 +22,98 @@ def read_eval(m_path):
     return metric, task, db_name, case, df
 
 
-def test_rank(df):
-    import decoupler as dc
+def get_membership(df, mthds, steps=['pre', 'p2g', 'tfb', 'mdl']):
+    """Boolean step.method x grn membership matrix"""
+    mthds = np.asarray(mthds, dtype=object)
+    terms = np.array(['{0}.{1}'.format(step, mth) for step in steps for mth in mthds])
+    msk = np.concatenate([df[step].to_numpy(dtype=object)[None, :] == mthds[:, None] for step in steps])
+    return terms, msk
+
+
+def compute_es(row, msk):
+    """GSEA enrichment score of each set mask (sets x features) over features
+    sorted by decreasing row, as decoupler computes it"""
+    abs_row = np.abs(row)
+    k = msk.sum(1, keepdims=True)
+    sum_set = (msk * abs_row).sum(1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        walk = np.where(msk, abs_row / sum_set, -1. / (row.size - k))
+    walk = np.cumsum(walk, axis=1)
+    mx_pos = np.maximum(walk.max(1), 0.)
+    mx_neg = np.minimum(walk.min(1), 0.)
+    es = np.where(mx_pos > -mx_neg, mx_pos, mx_neg)
+    es[sum_set[:, 0] == 0] = 0.
+    return es
+
+
+def run_gsea(row, msk, times=1000, min_n=5, seed=42):
+    """Permutation GSEA of all sets at once, the null of each set size is
+    computed from one shared batch of permuted feature ranks"""
+    # Randomize feature order to break ties randomly
+    rng = np.random.default_rng(seed)
+    idx = rng.permutation(row.size)
+    row, msk = row[idx], msk[:, idx]
+    order = np.argsort(-row, kind='stable')
+    row, msk = row[order], msk[:, order]
+    sizes = msk.sum(1)
+    keep = sizes >= min_n
+    es = compute_es(row, msk)
+    pvals = np.full(es.size, np.inf)
+    # Random ranks of the features, the first k give a random set of size k
+    ranks = rng.permuted(np.tile(np.arange(row.size), (times, 1)), axis=1)
+    for k in np.unique(sizes[keep]):
+        null = compute_es(row, ranks < k)
+        pos, neg = null[null >= 0.], null[null < 0.]
+        for j in np.flatnonzero(keep & (sizes == k)):
+            if (es[j] >= 0) and (pos.size > 0):
+                pvals[j] = np.sum(pos >= es[j]) / pos.size
+            elif (es[j] < 0) and (neg.size > 0):
+                pvals[j] = np.sum(neg <= es[j]) / neg.size
+    return es[keep], pvals[keep], keep
+
+
+def test_rank(df, times=1000, seed=42):
     steps = ['pre', 'p2g', 'tfb', 'mdl']
+    # Methods of all grns, including those left without scores by dropna
     mthds = df['pre'].unique()
-    net = []
     sts = []
     for step in steps:
         sts.append(df.groupby([step], as_index=False)['f01'].mean().rename(columns={step: 'name'}).assign(stp=step))
-        for mth in mthds:
-            for name in df[df[step] == mth]['name']:
-                net.append(['{0}.{1}'.format(step, mth), name])
-    net = pd.DataFrame(net, columns=['source', 'target'])
     sts = pd.concat(sts)
-    res = dc.get_gsea_df(
-        df=df.dropna().set_index('name'),
-        stat='f01',
-        net=net,
-        times=1000
-    )
-    res['padj'] = np.where(res['ES'] > 0, res['FDR p-value'], 1)
+    df = df.dropna(subset=['f01'])
+    terms, msk = get_membership(df, mthds, steps=steps)
+    es, pvals, keep = run_gsea(df['f01'].values.astype(np.float64), msk, times=times, seed=seed)
+    res = pd.DataFrame({'Term': terms[keep], 'ES': es})
+    padj = ss.false_discovery_control(np.where(np.isfinite(pvals), pvals, 1.)) if pvals.size > 0 else pvals
+    res['padj'] = np.where(res['ES'] > 0, padj, 1)
     res[['stp', 'name']] = res['Term'].str.split('.', n=2, expand=True)
     res = res[['stp', 'name', 'padj']]
     res = pd.merge(res, sts, how='left', on=['stp', 'name'])
     return res
 
 
+def test_path(m_path, times, seed):
+    metric, task, db_name, case, m_df = read_eval(m_path)
+    m_df = test_rank(m_df, times=times, seed=seed)
+    m_df[['metric', 'task', 'db', 'case']] = metric, task, db_name, case
+    return m_df
+
+
 parser = argparse.ArgumentParser()
 parser.add_argument('-m', '--path_mtr', nargs='+', required=True)
 parser.add_argument('-o', '--path_out', required=True)
+parser.add_argument('-n', '--n_jobs', default=1, type=int)
+parser.add_argument('-t', '--times', default=1000, type=int)
+parser.add_argument('-s', '--seed', default=42, type=int)
 args = parser.parse_args()
 
 # Test each metric-database
-df = []
-for m_path in args.path_mtr:
-    metric, task, db_name, case, m_df = read_eval(m_path)
-    m_df = test_rank(m_df)
-    m_df[['metric', 'task', 'db', 'case']] = metric, task, db_name, case
-    df.append(m_df)
+func = partial(test_path, times=args.times, seed=args.seed)
+if args.n_jobs > 1:
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.n_jobs) as executor:
+        df = list(executor.map(func, args.path_mtr))
+else:
+    df = [func(m_path) for m_path in args.path_mtr]
 df = pd.concat(df)
 df = df[['metric', 'task', 'db', 'stp', 'name', 'case', 'padj', 'f01']]
 df = df.sort_values(['metric', 'task', 'db', 'stp', 'name'])
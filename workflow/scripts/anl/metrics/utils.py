@@ -1,4 +1,12 @@
+import numpy as np
+import pandas as pd
+import traceback
 import json
+import re
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from anl.utils import read_grn, get_cache_path, is_cached, write_npz, get_names, hash_file, get_tmp_path
 
 
 def load_cats(dataset, case):
@@ -14,3 +22,181 @@ def f_beta_score(prc, rcl, beta=0.1):
     if prc + rcl == 0:
         return 0
     return (1 + beta**2) * (prc * rcl) / ((prc * beta**2) + rcl)
+
+
+def fisher_sf(a, ab, ac, n):
+    """One-sided Fisher exact test p-values P(X >= a) for overlaps a of sets
+    of sizes ab and ac in a universe of n, vectorized from decoupler's test1r.
+    Terms are summed from a outwards until they no longer change the sum,
+    which is much faster than scipy's hypergeom.sf on large arrays"""
+    from scipy.special import gammaln
+    a, ab, ac, n = [x.astype(np.int64).ravel() for x in np.broadcast_arrays(a, ab, ac, n)]
+
+    def lterm(i, k):
+        return gammaln(i + 1) + gammaln(ab[k] - i + 1) + gammaln(ac[k] - i + 1) + gammaln(n[k] - ab[k] - ac[k] + i + 1)
+
+    k = np.arange(a.size)
+    a_min = np.maximum(0, ab + ac - n)
+    a_max = np.minimum(ab, ac)
+    p0 = gammaln(ab + 1) + gammaln(ac + 1) + gammaln(n - ac + 1) + gammaln(n - ab + 1) - gammaln(n + 1)
+    pa = lterm(a, k)
+    # Below the expected overlap sum the left tail, else the right one
+    left = ab.astype(float) * ac > a.astype(float) * n
+    step = np.where(left, -1, 1)
+    s = np.where(left, 0., 1.)
+    i = a + step
+    active = np.where(left, i >= a_min, i <= a_max)
+    while active.any():
+        k = np.flatnonzero(active)
+        s_new = s[k] + np.exp(pa[k] - lterm(i[k], k))
+        done = s_new == s[k]
+        s[k] = s_new
+        i[k] += step[k]
+        active[k] = ~done & np.where(left[k], i[k] >= a_min[k], i[k] <= a_max[k])
+    pmf = np.exp(p0 - pa)
+    pvals = np.where(left, 1. - np.maximum(0., pmf * s), np.minimum(1., pmf * s))
+    pvals[a_min == a_max] = 1.
+    return pvals
+
+
+def get_grn_info(grn_path):
+    grn_name = os.path.basename(grn_path).replace('.grn.csv', '')
+    data_path = os.path.join(os.path.dirname(os.path.dirname(grn_path)), 'mdata.h5mu')
+    dataset = os.path.basename(os.path.dirname(os.path.dirname(os.path.dirname(data_path))))
+    case = os.path.basename(os.path.dirname(data_path))
+    return grn_name, data_path, dataset, case
+
+
+def run_evaluate(evaluate, grn_path, ctx):
+    """Scores of a grn with a status column, ok when evaluate returns and
+    NaN scores with timeout or failed when it raises. Per grn and batch jobs
+    both score through here, so a failing grn gives the same row in both"""
+    try:
+        df = evaluate(grn_path, ctx)
+        status = 'ok'
+    except Exception as e:
+        print('Failed to score {0}'.format(grn_path), file=sys.stderr)
+        traceback.print_exc()
+        df = pd.DataFrame([[get_grn_info(grn_path)[0], np.nan, np.nan, np.nan]], columns=['name', 'prc', 'rcl', 'f01'])
+        status = 'timeout' if isinstance(e, TimeoutError) else 'failed'
+    df['status'] = status
+    return df
+
+
+def get_case_info(grn_paths):
+    """Dataset info shared by a batch of grns, which must come from the same case"""
+    data_paths = set([get_grn_info(p)[1] for p in grn_paths])
+    if len(data_paths) != 1:
+        raise ValueError('All grns of a batch must belong to the same dataset case')
+    _, data_path, dataset, case = get_grn_info(grn_paths[0])
+    return data_path, dataset, case
+
+
+def parse_score_path(path):
+    """Keys of an aggregated scores or batch file (anl/metrics/{metric}/{task}/{db}/{dts}.{case}.*)"""
+    parts = os.path.normpath(path).split(os.sep)
+    metric, task, db = parts[-4:-1]
+    dts, case = parts[-1].split('.')[:2]
+    return dict(metric=metric, task=task, db=db, dts=dts, case=case)
+
+
+SCORE_KEYS = ['metric', 'task', 'db', 'dts', 'case', 'name']
+SCORE_COLS = SCORE_KEYS + ['prc', 'rcl', 'f01', 'partial', 'status', 'runtime', 'mem']
+
+
+def connect_scores(db_path):
+    """Open the scores database of a batch job, creating its table if needed.
+    Each batch job writes its own database, so there is a single writer"""
+    import sqlite3
+    db_dir = os.path.dirname(os.path.abspath(db_path))
+    os.makedirs(db_dir, exist_ok=True)
+    con = sqlite3.connect(db_path)
+    con.execute(
+        'CREATE TABLE IF NOT EXISTS scores ('
+        'metric TEXT, task TEXT, db TEXT, dts TEXT, "case" TEXT, name TEXT, '
+        'prc REAL, rcl REAL, f01 REAL, partial INTEGER, status TEXT, runtime REAL, mem REAL, '
+        'PRIMARY KEY (metric, task, db, dts, "case", name)) WITHOUT ROWID'
+    )
+    return con
+
+
+def write_scores(db_path, df, **keys):
+    """Upsert the name, prc, rcl, f01 (and optional partial, status, runtime, mem) rows
+    of df under the metric, task, db, dts and case keys, in a single transaction.
+    runtime is in seconds and mem the peak rss in MB of the process that
+    scored the grn, which may include the grns it scored before"""
+    df = df.assign(**keys)
+    for col in ['partial', 'status', 'runtime', 'mem']:
+        if col not in df.columns:
+            df[col] = np.nan
+    rows = df[SCORE_COLS].astype(object).where(df[SCORE_COLS].notna(), None).values.tolist()
+    con = connect_scores(db_path)
+    try:
+        with con:
+            con.executemany(
+                'INSERT OR REPLACE INTO scores ({0}) VALUES ({1})'.format(
+                    ', '.join('"{0}"'.format(c) for c in SCORE_COLS), ', '.join(['?'] * len(SCORE_COLS))
+                ),
+                rows
+            )
+    finally:
+        con.close()
+
+
+def read_scores(db_path, names=None, **keys):
+    """Scores rows matching the given keys, restricted to names if given and
+    returned in their order"""
+    con = connect_scores(db_path)
+    try:
+        where = ' AND '.join('"{0}" = ?'.format(k) for k in keys)
+        query = 'SELECT * FROM scores' + (' WHERE ' + where if where else '')
+        df = pd.read_sql_query(query, con, params=list(keys.values()))
+    finally:
+        con.close()
+    if names is not None:
+        df = df.set_index('name').reindex(names).reset_index()
+    return df
+
+
+def read_knocktf(bnc_path):
+    """Memory map the knocktf diff matrix, converted once from diff.csv to npy"""
+    csv_path = os.path.join(bnc_path, 'diff.csv')
+    npy_path = os.path.join(bnc_path, 'diff.npy')
+    idx_path = os.path.join(bnc_path, 'diff.idx.npz')
+    if not (is_cached(npy_path, [csv_path]) and is_cached(idx_path, [csv_path])):
+        mat = pd.read_csv(csv_path, index_col=0)
+        tmp_path = get_tmp_path(npy_path, suffix='.tmp.npy')
+        try:
+            np.save(tmp_path, mat.values)
+            os.replace(tmp_path, npy_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        write_npz(idx_path, obs_names=mat.index.values.astype('U'), var_names=mat.columns.values.astype('U'))
+    idx = np.load(idx_path)
+    X = np.load(npy_path, mmap_mode='r')
+    return X, idx['obs_names'], idx['var_names']
+
+
+def load_knocktf(bnc_path, data_path, dataset, case):
+    """Knocktf experiments of a case (matching cats, measured TF and logFC < -0.5)"""
+    rsc_name = os.path.basename(os.path.normpath(bnc_path))
+    meta_path = os.path.join(bnc_path, 'meta.csv')
+    X, obs_names, var_names = read_knocktf(bnc_path)
+    obs = pd.read_csv(meta_path, index_col=0)
+
+    # Filtered experiments are shared across all grns of the case
+    cache_path = get_cache_path(data_path, '{0}.npz'.format(rsc_name))
+    if not is_cached(cache_path, [meta_path, os.path.join(bnc_path, 'diff.csv'), data_path, 'config/prior_cats.json']):
+        genes = get_names(data_path, 'rna')
+        cats = load_cats(dataset, case)
+        cats = [re.escape(c) for c in cats[rsc_name]]
+        msk = obs['Tissue.Type'].isin(cats) & obs['TF'].isin(genes) & (obs['logFC'] < -0.5)
+        rows = pd.Index(obs_names).get_indexer(obs.index[msk])
+        write_npz(cache_path, rows=rows)
+    rows = np.load(cache_path)['rows']
+
+    # Read only the selected experiments
+    obs = obs.loc[obs_names[rows], :]
+    mat = pd.DataFrame(X[rows], index=obs.index, columns=var_names)
+    return obs, mat
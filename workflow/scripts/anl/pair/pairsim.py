@@ -7,6 +7,7 @@ from tqdm import tqdm
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from utils import (
     ocoeff,
+    read_grn,
 )
 import glob
 import argparse
@@ -35,7 +36,7 @@ df = []
 for i in tqdm(range(len(path_pair))):
     p_path, n_path = path_pair[i], path_npair[i]
     assert os.path.basename(p_path) == os.path.basename(n_path)
-    p_grn, n_grn = pd.read_csv(p_path), pd.read_csv(n_path)
+    p_grn, n_grn = read_grn(p_path, columns=['source', 'target']), read_grn(n_path, columns=['source', 'target'])
     val = ocoeff(p_grn, n_grn, on=['source', 'target'])
     df.append([os.path.basename(p_path).replace('.grn.csv', ''), val])
 df = pd.DataFrame(df, columns=['mth', 'ocoef'])
@@ -3,7 +3,7 @@ import scipy.stats as ss
 import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from utils import read_config, ocoeff
+from utils import read_config, ocoeff, read_grn
 
 
 # Extract dat and case
@@ -18,8 +18,8 @@ baselines = config['baselines']
 # Compute ocoeff and pearson
 df = []
 for mth in mthds:
-    ref = pd.read_csv(f'dts/{dat}/cases/{case}/runs/o_{mth}.o_{mth}.o_{mth}.o_{mth}.grn.csv')
-    net = pd.read_csv(f'dts/{dat}/cases/{case}/runs/{mth}.{mth}.{mth}.{mth}.grn.csv')
+    ref = read_grn(f'dts/{dat}/cases/{case}/runs/o_{mth}.o_{mth}.o_{mth}.o_{mth}.grn.csv')
+    net = read_grn(f'dts/{dat}/cases/{case}/runs/{mth}.{mth}.{mth}.{mth}.grn.csv')
     inter = pd.merge(ref, net, on=['source', 'target'], how='inner')
     s, p = ss.pearsonr(inter['score_x'], inter['score_y'])
     df.append([mth, ocoeff(ref, net, on=['source', 'target']), s, p])
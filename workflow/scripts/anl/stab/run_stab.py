@@ -2,15 +2,16 @@ import pandas as pd
 import numpy as np
 import argparse
 import os
-import re
 import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from utils import ocoeff
+from utils import ocoeff, read_grn
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from telemetry import read_benchmark
 
 
 # Init args
 parser = argparse.ArgumentParser()
-parser.add_argument('-i','--inp_path', required=True)
+parser.add_argument('-i','--inp_path', required=True, nargs='+')
 parser.add_argument('-r','--res_path', required=True)
 parser.add_argument('-a','--auc_path', required=True)
 args = vars(parser.parse_args())
@@ -19,25 +20,19 @@ inp_path = args['inp_path']
 res_path = args['res_path']
 auc_path = args['auc_path']
 
-def time_to_hours(time_str):
-    h, m, s = map(int, time_str.split(':'))
-    return h + (m / 60) + (s / 60 / 60)
-
-
-def memory_to_gb(memory_str):
-    if memory_str != '0':
-        unit = memory_str[-1]
-        value = int(np.ceil(float(memory_str[:-1])))
-        if unit == 'K':
-            return value / 1048576.0
-        elif unit == 'M':
-            return value / 1024.0
-        elif unit == 'G':
-            return float(value)
-        else:
-            raise ValueError("Unsupported memory unit. Please use K, M, or G.")
-    else:
-        return 0.
+def read_bench(grn_path):
+    """Method, dataset, case, hours and peak GB of a grn from the benchmark of
+    its mdl rule (dts/{dat}/cases/{case}/runs/{mth}.{mth}.{mth}.{mth}.bench.tsv),
+    NaN hours and GB for grns run before benchmarking was added"""
+    parts = os.path.normpath(grn_path).split(os.sep)
+    ds, case, mth = parts[-5], parts[-3], parts[-1].split('.')[0]
+    bench_path = os.path.join(os.path.dirname(grn_path), '{0}.{0}.{0}.{0}.bench.tsv'.format(mth))
+    bench = read_benchmark(bench_path)
+    h = bench['s'] / 60 / 60
+    gb = bench['max_rss'] / 1024
+    if os.path.isfile(bench_path) and np.isnan(gb):
+        gb = 0.
+    return mth, ds, case, h, gb
 
 
 def get_grn_stats(df):
@@ -51,26 +46,23 @@ def get_grn_stats(df):
 
 
 # Read
-df = pd.read_csv(inp_path, sep=' ', header=None)
 dataset = os.path.basename(res_path).replace('.csv', '')
 res = []
 seeds = np.array(['0', '1', '2'])
-for _, row in list(df.iterrows()):
-    s, time, mem = row[0], row[1], row[2]
-    mth = re.search(r'mdl_(.*?)_dat', s).group(1)
-    ds = re.search(r'=(.*?).case=', s).group(1)
-    case = re.search(r'case=([\w_]+)', s).group(1)
-    
+for grn_path in inp_path:
+    mth, ds, case, h, gb = read_bench(grn_path)
+
     if (ds == dataset) or (case != 'all'):
         if case.startswith('16384'):
             if case.startswith('16384_16384_'):
                 cat = 'full'
                 ncells, nfeats, seed = case.split('_')
                 n = 16384
-                net = pd.read_csv('dts/{dataset}/cases/{ncells}_{nfeats}_{seed}/runs/{mth}.{mth}.{mth}.{mth}.grn.csv'.
+                net = read_grn('dts/{dataset}/cases/{ncells}_{nfeats}_{seed}/runs/{mth}.{mth}.{mth}.{mth}.grn.csv'.
                           format(dataset=ds, ncells=ncells, nfeats=nfeats, seed=seed, mth=mth))
+                net_stats = get_grn_stats(net)
                 for s in [s for s in seeds if s != seed]:
-                    ref = pd.read_csv('dts/{dataset}/cases/{ncells}_{nfeats}_{seed}/runs/{mth}.{mth}.{mth}.{mth}.grn.csv'.
+                    ref = read_grn('dts/{dataset}/cases/{ncells}_{nfeats}_{seed}/runs/{mth}.{mth}.{mth}.{mth}.grn.csv'.
                           format(dataset=ds, ncells=ncells, nfeats=nfeats, seed=s, mth=mth))
                     tmp = pd.DataFrame(index=[0])
                     tmp['mth'] = mth.replace('o_', '')
@@ -78,12 +70,12 @@ for _, row in list(df.iterrows()):
                     tmp['n'] = int(n)
                     tmp['seed'] = int(seed)
                     tmp['other_seed'] = int(s)
-                    tmp['h'] = time_to_hours(time)
-                    tmp['gb'] = memory_to_gb(mem)
+                    tmp['h'] = h
+                    tmp['gb'] = gb
                     tmp['s_ocoeff'] = ocoeff(ref, net, on=['source'])
                     tmp['e_ocoeff'] = ocoeff(ref, net, on=['source', 'target'])
                     tmp['t_ocoeff'] = ocoeff(ref, net, on=['target'])
-                    tmp[['n_sources', 'n_edges', 'n_targets', 'r_size']] = get_grn_stats(net)
+                    tmp[['n_sources', 'n_edges', 'n_targets', 'r_size']] = net_stats
                     res.append(tmp)
                 continue
             else:
@@ -96,9 +88,9 @@ for _, row in list(df.iterrows()):
             ncells, nfeats = n, 16384
         else:
             continue
-        ref = pd.read_csv('dts/{dataset}/cases/16384_16384_0/runs/{mth}.{mth}.{mth}.{mth}.grn.csv'.
+        ref = read_grn('dts/{dataset}/cases/16384_16384_0/runs/{mth}.{mth}.{mth}.{mth}.grn.csv'.
                           format(dataset=ds, mth=mth))
-        net = pd.read_csv('dts/{dataset}/cases/{ncells}_{nfeats}_{seed}/runs/{mth}.{mth}.{mth}.{mth}.grn.csv'.
+        net = read_grn('dts/{dataset}/cases/{ncells}_{nfeats}_{seed}/runs/{mth}.{mth}.{mth}.{mth}.grn.csv'.
                           format(dataset=ds, ncells=ncells, nfeats=nfeats, seed=seed, mth=mth))
         tmp = pd.DataFrame(index=[0])
         tmp['mth'] = mth.replace('o_', '')
@@ -106,8 +98,8 @@ for _, row in list(df.iterrows()):
         tmp['n'] = int(n)
         tmp['seed'] = int(seed)
         tmp['other_seed'] = np.nan
-        tmp['h'] = time_to_hours(time)
-        tmp['gb'] = memory_to_gb(mem)
+        tmp['h'] = h
+        tmp['gb'] = gb
         tmp['s_ocoeff'] = ocoeff(ref, net, on=['source'])
         tmp['e_ocoeff'] = ocoeff(ref, net, on=['source', 'target'])
         tmp['t_ocoeff'] = ocoeff(ref, net, on=['target'])
@@ -115,9 +107,6 @@ for _, row in list(df.iterrows()):
         res.append(tmp)
 res = pd.concat(res)
 
-# Drop potential duplicates from sacct
-res = res.drop_duplicates(['mth', 'cat', 'n', 'seed', 'other_seed'], keep='last')
-
 # Sort
 res = res.sort_values(['mth', 'cat', 'n', 'seed']).reset_index(drop=True)
 
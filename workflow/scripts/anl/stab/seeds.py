@@ -4,7 +4,7 @@ import numpy as np
 import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from utils import read_config
+from utils import read_config, read_grn
 
 
 # Read config
@@ -29,10 +29,10 @@ for mth in mthds:
     for i, seed_a in enumerate(seeds):
         seed_a = str(seed_a)
         path_a = f'dts/{dname}/cases/16384_16384_{seed_a}/runs/{mth}.{mth}.{mth}.{mth}.grn.csv'
-        grn_a = pd.read_csv(path_a)[['source', 'target', 'score']]
+        grn_a = read_grn(path_a, columns=['source', 'target', 'score'])
         for seed_b in seeds[i + 1:]:
             path_b = f'dts/{dname}/cases/16384_16384_{seed_b}/runs/{mth}.{mth}.{mth}.{mth}.grn.csv'
-            grn_b = pd.read_csv(path_b)[['source', 'target', 'score']]
+            grn_b = read_grn(path_b, columns=['source', 'target', 'score'])
             df.append(pd.merge(grn_a, grn_b, how='inner', on=['source', 'target']).assign(comp=f'{seed_a}_{seed_b}'))
     mth = mth.replace('o_', '')
     df = pd.concat(df)
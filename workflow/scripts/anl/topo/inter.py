@@ -1,5 +1,9 @@
 import pandas as pd
 import numpy as np
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils import read_grn
 import argparse
 
 
@@ -16,11 +20,11 @@ blns = []
 for grn_path in args.paths_grns:
     name = grn_path.split('.')[-3]
     if name.startswith('o_') and (name not in args.baselines):
-        grn = pd.read_csv(grn_path).drop_duplicates(['source', 'target'])
+        grn = read_grn(grn_path, dedup=True)
         grn['name'] = name.replace('o_', '')
         grns.append(grn)
     elif name in args.baselines:
-        grn = pd.read_csv(grn_path).drop_duplicates(['source', 'target']).drop(columns='cre')
+        grn = read_grn(grn_path, dedup=True).drop(columns='cre')
         grn['name'] = name
         blns.append(grn)
         
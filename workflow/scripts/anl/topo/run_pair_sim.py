@@ -1,6 +1,7 @@
 import concurrent.futures
 import pandas as pd
 import numpy as np
+import scipy.sparse as sps
 import os
 import glob
 from tqdm import tqdm
@@ -10,7 +11,8 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 from utils import (
     ocoeff,
     get_grn_name,
-    get_grn_stats
+    load_grn_stats,
+    read_grn
 )
 import argparse
 
@@ -19,10 +21,21 @@ import argparse
 parser = argparse.ArgumentParser()
 parser.add_argument('-t','--stat_path', required=True)
 parser.add_argument('-s','--sim_path', required=True)
+parser.add_argument('-m','--mode', default='sparse', choices=['sparse', 'sets'])
+parser.add_argument('-n','--n_jobs', default=1, type=int)
+parser.add_argument('-c','--chunk_size', default=256, type=int)
+parser.add_argument('-b','--max_edges', default=0, type=int)
+parser.add_argument('-p','--n_pivots', default=256, type=int)
 args = vars(parser.parse_args())
 
 stat_path = args['stat_path']
 sim_path = args['sim_path']
+mode = args['mode']
+n_jobs = args['n_jobs']
+chunk_size = args['chunk_size']
+# Approximate betweenness above max_edges edges, exact when 0
+max_edges = args['max_edges'] if args['max_edges'] > 0 else None
+n_pivots = args['n_pivots']
 
 dat, case = os.path.basename(stat_path).split('.')[:2]
 paths = glob.glob(os.path.join('dts', dat, 'cases', case, 'runs', '*.grn.csv'))
@@ -38,16 +51,20 @@ genes = []
 for path in tqdm(paths):
     name = get_grn_name(path)
     names.append(name)
-    df = pd.read_csv(path).drop_duplicates(['source', 'target'], keep='first')
-    stat = get_grn_stats(df)
+    df = read_grn(path, columns=['source', 'target'], dedup=True)
+    stat = load_grn_stats(path, grn=df, max_edges=max_edges, n_pivots=n_pivots)
     stats.append([name] + list(stat))
-    tfs.append(set(df['source']))
-    edges.append(set(df['source'] + '|' + df['target']))
-    genes.append(set(df['target']))
-    
+    if mode == 'sets':
+        tfs.append(set(df['source']))
+        edges.append(set(df['source'] + '|' + df['target']))
+        genes.append(set(df['target']))
+    else:
+        tfs.append(df['source'].values.astype(object))
+        genes.append(df['target'].values.astype(object))
+
 
 # Store as df
-cols = ['name', 'n_tfs', 'n_edges', 'n_targets', 'odegree', 'betweenc', 'eigv']
+cols = ['name', 'n_tfs', 'n_edges', 'n_targets', 'odegree', 'betweenc', 'eigv', 'betweenc_err']
 stats = pd.DataFrame(stats, columns=cols)
 
 print('Computing pairwise overlap coefficients...')
@@ -62,26 +79,93 @@ def set_ocoef(a, b):
         return inter / min_s
 
 
-names_a = []
-names_b = []
-tf_coefs = []
-edge_coefs = []
-target_coefs = []
-for i in tqdm(range(len(names))):
-    name_a = names[i]
-    tf_a = tfs[i]
-    ed_a = edges[i]
-    gn_a = genes[i]
-    for j in range(i, len(names)):
-        name_b = names[j]
-        tf_b = tfs[j]
-        ed_b = edges[j]
-        gn_b = genes[j]
-        names_a.append(name_a)
-        names_b.append(name_b)
-        tf_coefs.append(set_ocoef(tf_a, tf_b))
-        edge_coefs.append(set_ocoef(ed_a, ed_b))
-        target_coefs.append(set_ocoef(gn_a, gn_b))
+def compute_sets(tfs, edges, genes):
+    tf_coefs = []
+    edge_coefs = []
+    target_coefs = []
+    for i in tqdm(range(len(names))):
+        tf_a = tfs[i]
+        ed_a = edges[i]
+        gn_a = genes[i]
+        for j in range(i, len(names)):
+            tf_b = tfs[j]
+            ed_b = edges[j]
+            gn_b = genes[j]
+            tf_coefs.append(set_ocoef(tf_a, tf_b))
+            edge_coefs.append(set_ocoef(ed_a, ed_b))
+            target_coefs.append(set_ocoef(gn_a, gn_b))
+    return tf_coefs, edge_coefs, target_coefs
+
+
+def get_incidence(rows, codes, n_rows):
+    """Binary grns x vocabulary matrix from (row, code) pairs"""
+    n_cols = codes.max() + 1 if codes.size > 0 else 0
+    mat = sps.csr_matrix((np.ones(codes.size, dtype=np.int64), (rows, codes)), shape=(n_rows, n_cols))
+    mat.sum_duplicates()
+    mat.data[:] = 1
+    return mat
+
+
+def encode_grns(srcs, trgs):
+    """Encode tfs, targets and edges of all grns in one shared integer vocabulary"""
+    n_grns = len(srcs)
+    sizes = np.array([s.size for s in srcs], dtype=np.int64)
+    rows = np.repeat(np.arange(n_grns), sizes)
+    if sizes.sum() > 0:
+        nodes = np.concatenate(srcs + trgs)
+    else:
+        nodes = np.array([], dtype=object)
+    codes, vocab = pd.factorize(nodes)
+    codes = codes.astype(np.int64)
+    s_codes, t_codes = codes[:rows.size], codes[rows.size:]
+    e_codes, _ = pd.factorize(s_codes * max(vocab.size, 1) + t_codes)
+    tf_mat = get_incidence(rows, s_codes, n_grns)
+    edge_mat = get_incidence(rows, e_codes.astype(np.int64), n_grns)
+    target_mat = get_incidence(rows, t_codes, n_grns)
+    return tf_mat, edge_mat, target_mat
+
+
+def chunk_ocoefs(mats, start, end):
+    """Overlap coefficients of rows [start, end) against rows j >= i"""
+    res = []
+    for mat in mats:
+        sizes = np.diff(mat.indptr)
+        inter = (mat[start:end] @ mat.T).toarray()
+        coefs = []
+        for k, i in enumerate(range(start, end)):
+            min_s = np.minimum(sizes[i], sizes[i:])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                coef = inter[k, i:] / min_s
+            coef[min_s == 0] = np.nan
+            coefs.append(coef)
+        res.append(np.concatenate(coefs) if len(coefs) > 0 else np.array([], dtype=float))
+    return res
+
+
+def compute_sparse(tfs, genes, n_jobs, chunk_size):
+    mats = encode_grns(tfs, genes)
+    n = len(tfs)
+    chunks = [(s, min(s + chunk_size, n)) for s in range(0, n, chunk_size)]
+    if n_jobs > 1 and len(chunks) > 1:
+        func = partial(chunk_ocoefs, mats)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            res = list(tqdm(executor.map(func, *zip(*chunks)), total=len(chunks)))
+    else:
+        res = [chunk_ocoefs(mats, s, e) for s, e in tqdm(chunks)]
+    if len(res) == 0:
+        return [], [], []
+    tf_coefs, edge_coefs, target_coefs = [np.concatenate(r) for r in zip(*res)]
+    return tf_coefs, edge_coefs, target_coefs
+
+
+if mode == 'sets':
+    tf_coefs, edge_coefs, target_coefs = compute_sets(tfs, edges, genes)
+else:
+    tf_coefs, edge_coefs, target_coefs = compute_sparse(tfs, genes, n_jobs, chunk_size)
+names_a, names_b = [], []
+for i in range(len(names)):
+    names_a.extend([names[i]] * (len(names) - i))
+    names_b.extend(names[i:])
 
 
 # Store as df
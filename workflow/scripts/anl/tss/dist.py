@@ -3,6 +3,9 @@ import pyranges as pr
 from tqdm import tqdm
 import os
 import glob
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils import read_grn
 import argparse
 
 
@@ -21,11 +24,11 @@ dname, case = os.path.basename(path_cmp).split('.')[:2]
 path_grns = glob.glob(os.path.join('dts', dname, 'cases', case, 'runs', '*.grn.csv'))
 def compute_dist_tss(path, mth):
     if mth.startswith('o_'):
-        grn = pd.read_csv(path)
-        cre_grn = pd.read_csv(path.replace('o_', '')).rename(columns={'tf': 'source', 'gene': 'target'})
+        grn = read_grn(path)
+        cre_grn = read_grn(path.replace('o_', '')).rename(columns={'tf': 'source', 'gene': 'target'})
         grn = pd.merge(grn, cre_grn[['source', 'cre', 'target']])
     else:
-        grn = pd.read_csv(path)
+        grn = read_grn(path)
     mth = mth.replace('o_', '')
     grn = grn.drop_duplicates(['cre', 'target'])
     grn[['Chromosome', 'Start', 'End']] = grn['cre'].str.split('-', expand=True)
@@ -1,6 +1,9 @@
 import pandas as pd
 import numpy as np
 import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from grn_store import read_grn_store
 
 
 def read_config(path_config='config/config.yaml'):
@@ -15,23 +18,86 @@ def get_grn_name(grn_path):
     return name
 
 
-def get_grn_stats(grn):
+def approx_betweenness(g, n_pivots, seed=0):
+    """Mean betweenness estimated from the BFS distances of sampled pivots,
+    with the half-width of its 95% confidence interval. The betweenness of
+    all nodes sums to the sum of d(s, t) - 1 over reachable pairs, so only
+    nodes with out edges (the tfs) need to be sampled as sources"""
+    n = g.vcount()
+    srcs = np.flatnonzero(np.array(g.outdegree()) > 0)
+    m = srcs.size
+    if m == 0:
+        return 0., 0.
+    rng = np.random.default_rng(seed)
+    pivots = rng.choice(srcs, size=min(n_pivots, m), replace=False)
+    dist = np.array(g.distances(source=pivots.tolist(), mode='out'), dtype=float)
+    dist[~np.isfinite(dist) | (dist == 0)] = 1.
+    x = np.sum(dist - 1., axis=1) * m / n
+    if pivots.size < 2 or pivots.size == m:
+        return np.mean(x), 0.
+    # Finite population correction, pivots are sampled without replacement
+    err = 1.96 * np.std(x, ddof=1) / np.sqrt(pivots.size) * np.sqrt((m - pivots.size) / (m - 1))
+    return np.mean(x), err
+
+
+def get_grn_stats(grn, max_edges=None, n_pivots=256, seed=0):
+    """Topology stats of a grn, betweenness is approximated from n_pivots
+    sampled sources when the grn has more than max_edges edges. The last
+    value is the error bound of the approximation (0 if exact)"""
     import igraph as ig
     if len(grn) == 0:
-        return np.nan, np.nan, np.nan, np.nan, np.nan, np.nan
+        return np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan
     n_s = grn['source'].unique().size
     n_e = grn.shape[0]
     n_t = grn['target'].unique().size
 
-    g = ig.Graph.TupleList(list(zip(grn['source'], grn['target'])), directed=True)
-    tf_bet = np.mean(g.betweenness())
+    codes, nodes = pd.factorize(np.concatenate([grn['source'].values, grn['target'].values]))
+    g = ig.Graph(n=nodes.size, edges=codes.reshape(2, -1).T, directed=True)
+    if (max_edges is not None) and (n_e > max_edges):
+        tf_bet, bet_err = approx_betweenness(g, n_pivots=n_pivots, seed=seed)
+    else:
+        tf_bet, bet_err = np.mean(g.betweenness()), 0.
     tf_odg = grn.groupby(['source']).size().mean()
     if not g.is_acyclic():
         tf_eig = np.mean(g.eigenvector_centrality())
     else:
         tf_eig = 0.
     
-    return n_s, n_e, n_t, tf_odg, tf_bet, tf_eig
+    return n_s, n_e, n_t, tf_odg, tf_bet, tf_eig, bet_err
+
+
+def hash_file(path, block_size=2 ** 20):
+    """Hex digest of the content of a file"""
+    import hashlib
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_grn_stats(grn_path, grn=None, max_edges=None, n_pivots=256, seed=0):
+    """get_grn_stats of the deduplicated source-target edges of a grn file,
+    cached in its case cache and keyed by the file content hash"""
+    import json
+    case_path = os.path.dirname(os.path.dirname(os.path.abspath(grn_path)))
+    cache_dir = os.path.join(case_path, 'cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_path = os.path.join(cache_dir, 'stats.{0}.json'.format(get_grn_name(grn_path)))
+    key = dict(hash=hash_file(grn_path), max_edges=max_edges, n_pivots=n_pivots, seed=seed)
+    if os.path.isfile(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+        if cache['key'] == key:
+            return tuple(np.nan if v is None else v for v in cache['stats'])
+    if grn is None:
+        grn = read_grn(grn_path, columns=['source', 'target'], dedup=True)
+    stats = get_grn_stats(grn, max_edges=max_edges, n_pivots=n_pivots, seed=seed)
+    tmp_path = get_tmp_path(cache_path)
+    with open(tmp_path, 'w') as f:
+        json.dump(dict(key=key, stats=[None if np.isnan(v) else float(v) for v in stats]), f)
+    os.replace(tmp_path, cache_path)
+    return stats
 
 
 def ocoeff(df_a, df_b, on=['source', 'target']):
@@ -45,3 +111,92 @@ def ocoeff(df_a, df_b, on=['source', 'target']):
     else:
         coeff = 0.
     return coeff
+
+
+def filter_df(df, filters):
+    """Apply pyarrow-style [(col, op, val)] filters to a df"""
+    msk = np.ones(df.shape[0], dtype=bool)
+    for col, op, val in filters:
+        if op in ['==', '=']:
+            msk &= (df[col] == val).values
+        elif op == '!=':
+            msk &= (df[col] != val).values
+        elif op == 'in':
+            msk &= df[col].isin(val).values
+        elif op == 'not in':
+            msk &= ~df[col].isin(val).values
+        else:
+            raise ValueError(f'Unsupported filter op {op}')
+    return df.loc[msk]
+
+
+def read_grn(grn_path, columns=None, filters=None, dedup=False):
+    """Read a grn from its case store, falling back to the csv when the
+    store is missing or was not written from the current csv"""
+    grn = read_grn_store(grn_path, columns=columns, filters=filters)
+    if grn is None:
+        usecols = None if columns is None else (lambda c: c in columns)
+        grn = pd.read_csv(grn_path, usecols=usecols)
+        if columns is not None:
+            grn = grn[[c for c in columns if c in grn.columns]]
+        if filters is not None:
+            grn = filter_df(grn, filters)
+    if dedup:
+        grn = grn.drop_duplicates(['source', 'target'], keep='first')
+    return grn
+
+
+def get_cache_path(data_path, name):
+    """Path of a file in the per case cache (dts/{dat}/cases/{case}/cache)"""
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(data_path)), 'cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, name)
+
+
+def is_cached(cache_path, dep_paths):
+    """Check that cache_path exists and is newer than its dependencies"""
+    if not os.path.isfile(cache_path):
+        return False
+    mtime = os.path.getmtime(cache_path)
+    return all(os.path.getmtime(p) <= mtime for p in dep_paths if os.path.exists(p))
+
+
+def get_tmp_path(path, suffix='.tmp'):
+    """Unique temporary file next to path, so that concurrent writers of the
+    same file never share it and os.replace stays atomic"""
+    import tempfile
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix=suffix, dir=os.path.dirname(os.path.abspath(path)))
+    os.close(fd)
+    return tmp_path
+
+
+def write_npz(path, **arrays):
+    """Atomically write arrays to an npz file"""
+    tmp_path = get_tmp_path(path, suffix='.tmp.npz')
+    try:
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def read_names(data_path, omic, axis='var'):
+    """Var or obs names of a modality, read straight from the h5mu without loading X"""
+    import h5py
+    with h5py.File(data_path, 'r') as f:
+        grp = f['mod'][omic][axis]
+        idx = grp.attrs.get('_index', '_index')
+        idx = idx.decode() if isinstance(idx, bytes) else idx
+        names = grp[idx]
+        names = names.asstr()[:] if h5py.check_string_dtype(names.dtype) is not None else names[:]
+    return np.asarray(names).astype('U')
+
+
+def get_names(data_path, omic, axis='var'):
+    """Var or obs names of a modality, cached per case"""
+    cache_path = get_cache_path(data_path, '{0}.{1}_names.npz'.format(omic, axis))
+    if not is_cached(cache_path, [data_path]):
+        write_npz(cache_path, names=read_names(data_path, omic, axis=axis))
+    return pd.Index(np.load(cache_path)['names'])
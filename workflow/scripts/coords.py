@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+
+# Any of chr-start-end, chr_start_end or chr:start-end, chromosome names may contain _
+CRE_PATTERN = r'^(?P<Chromosome>.+)[-_:](?P<Start>\d+)[-_](?P<End>\d+)$'
+
+
+def parse_cres(names):
+    """Split cre names into a categorical chromosome and int64 start and end arrays"""
+    names = np.asarray(names).astype('U')
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        parts = pc.extract_regex(pa.array(names, type=pa.string()), CRE_PATTERN)
+        if parts.null_count > 0:
+            raise ValueError('Invalid cre names')
+        chrom = parts.field('Chromosome').to_numpy(zero_copy_only=False).astype('U')
+        start = pc.cast(parts.field('Start'), pa.int64()).to_numpy()
+        end = pc.cast(parts.field('End'), pa.int64()).to_numpy()
+    except ImportError:
+        parts = pd.Series(names, dtype=object).str.extract(CRE_PATTERN)
+        if parts.isna().any().any():
+            raise ValueError('Invalid cre names')
+        chrom = parts['Chromosome'].values.astype('U')
+        start = parts['Start'].values.astype(np.int64)
+        end = parts['End'].values.astype(np.int64)
+    return pd.Categorical(chrom), start, end
+
+
+def format_cres(chrom, start, end, sep='-'):
+    """Join coordinates into chr-start-end (sep='-'), chr_start_end (sep='_') or chr:start-end (sep=':')"""
+    chrom = np.asarray(chrom).astype('U')
+    start = np.asarray(start).astype(np.int64)
+    end = np.asarray(end).astype(np.int64)
+    s_sep, e_sep = (':', '-') if sep == ':' else (sep, sep)
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        start = pc.cast(pa.array(start), pa.string())
+        end = pc.cast(pa.array(end), pa.string())
+        names = pc.binary_join_element_wise(pa.array(chrom, type=pa.string()), start, s_sep)
+        names = pc.binary_join_element_wise(names, end, e_sep)
+        names = names.to_numpy(zero_copy_only=False).astype('U')
+    except ImportError:
+        names = (pd.Series(chrom, dtype=object) + s_sep + pd.Series(start).astype(str) + e_sep + pd.Series(end).astype(str)).values.astype('U')
+    return names
+
+
+def convert_cres(names, sep='-'):
+    """Rewrite cre names in any format to the format of sep"""
+    return format_cres(*parse_cres(names), sep=sep)
+
+
+def cres_to_df(names):
+    """Chromosome, Start, End df of cre names, as taken by pyranges"""
+    chrom, start, end = parse_cres(names)
+    return pd.DataFrame({'Chromosome': np.asarray(chrom), 'Start': start, 'End': end})
+
+
+def get_case_cres(data_path, omic='atac'):
+    """Parsed var_names of a case modality, cached per case"""
+    from anl.utils import get_cache_path, is_cached, write_npz, get_names
+    cache_path = get_cache_path(data_path, '{0}.coords.npz'.format(omic))
+    if not is_cached(cache_path, [data_path]):
+        chrom, start, end = parse_cres(get_names(data_path, omic))
+        write_npz(cache_path, chrom=np.asarray(chrom).astype('U'), start=start, end=end)
+    cres = np.load(cache_path)
+    return pd.Categorical(cres['chrom']), cres['start'], cres['end']
@@ -9,8 +9,8 @@ import pandas as pd
 import numpy as np
 import os
 import sys
-from scipy.stats import pearsonr
-from scipy.sparse import issparse
+from scipy.stats import t as t_dist
+from scipy.sparse import issparse, csc_matrix
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -20,8 +20,10 @@ def parse_args():
     parser.add_argument('-o', '--output_dir', required=True, help='Output directory')
     parser.add_argument('--method', default='correlation', help='GRN inference method')
     parser.add_argument('--n_tfs', type=int, default=100, help='Number of top TFs to consider')
-    parser.add_argument('--n_genes', type=int, default=1000, help='Number of top genes to consider')
+    parser.add_argument('--n_genes', type=int, default=1000, help='Number of top genes to consider, 0 for all genes')
     parser.add_argument('--corr_threshold', type=float, default=0.3, help='Correlation threshold')
+    parser.add_argument('--top_k', type=int, default=0, help='Targets kept per TF, 0 to keep all significant')
+    parser.add_argument('--chunk_size', type=int, default=2048, help='Genes per correlation block')
     return parser.parse_args()
 
 def load_multiome_data(input_file):
@@ -60,15 +62,11 @@ def extract_expression_data(mdata):
         # MuData object
         rna_data = mdata.mod['rna']
         X = rna_data.X
-        if issparse(X):
-            X = X.toarray()
         gene_names = rna_data.var_names.tolist()
         cell_names = rna_data.obs_names.tolist()
     elif hasattr(mdata, 'X'):
         # AnnData object
         X = mdata.X
-        if issparse(X):
-            X = X.toarray()
         gene_names = mdata.var_names.tolist()
         cell_names = mdata.obs_names.tolist()
     else:
@@ -76,16 +74,70 @@ def extract_expression_data(mdata):
     
     return X, gene_names, cell_names
 
-def compute_correlation_grn(X, gene_names, tf_list, n_genes=1000, corr_threshold=0.3):
+def column_stats(X):
+    """Mean and population standard deviation of each column, sparse or dense"""
+    mean = np.asarray(X.mean(axis=0)).ravel()
+    if issparse(X):
+        sq = np.asarray(X.multiply(X).mean(axis=0)).ravel()
+    else:
+        sq = np.mean(X * X, axis=0)
+    std = np.sqrt(np.maximum(sq - mean ** 2, 0))
+    # E[x^2] - E[x]^2 cancels to round-off on constant columns, which would
+    # leave a tiny std and spurious +-1 correlations, so treat them as constant
+    std[std <= 4 * np.sqrt(np.finfo(np.float64).eps) * np.abs(mean)] = 0
+    return mean, std
+
+def correlation_block(X, tf_idx, gene_idx, mean, std):
+    """Pearson correlation of the TF columns against a block of gene columns,
+    from a single matrix product on the (sparse) expression matrix"""
+    n = X.shape[0]
+    X_tf = X[:, tf_idx]
+    X_tf = X_tf.toarray() if issparse(X_tf) else np.asarray(X_tf)
+    X_g = X[:, gene_idx]
+    # Cells x genes product, kept sparse on the gene side
+    prod = np.asarray((X_g.T @ X_tf).T) if issparse(X_g) else X_tf.T @ np.asarray(X_g)
+    cov = prod / n - np.outer(mean[tf_idx], mean[gene_idx])
+    scale = np.outer(std[tf_idx], std[gene_idx])
+    # Undefined for constant columns, as pearsonr returns NaN for them
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = np.where(scale > 0, cov / scale, np.nan)
+    return corr
+
+def correlation_pvals(corr, n):
+    """Two-sided p-values of Pearson correlations from the t-distribution"""
+    df = n - 2
+    # Round-off can push |r| just past 1, where pearsonr gives p = 0
+    r = np.minimum(np.abs(corr), 1.)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = r * np.sqrt(df / (1 - r ** 2))
+    return 2 * t_dist.sf(t, df)
+
+def keep_top_k(tf, gene, corr, pval, k):
+    """Keep the k strongest absolute correlations of each TF, using argpartition"""
+    keep = []
+    order = np.argsort(tf, kind='stable')
+    bounds = np.flatnonzero(np.diff(tf[order])) + 1
+    for grp in np.split(order, bounds):
+        if grp.size > k:
+            grp = grp[np.argpartition(-np.abs(corr[grp]), k - 1)[:k]]
+        keep.append(grp)
+    keep = np.concatenate(keep) if len(keep) > 0 else np.array([], dtype=np.int64)
+    return tf[keep], gene[keep], corr[keep], pval[keep]
+
+def compute_correlation_grn(X, gene_names, tf_list, n_genes=1000, corr_threshold=0.3, top_k=0, chunk_size=2048):
     """Compute correlation-based GRN"""
     print("Computing correlation-based GRN...")
     
-    # Convert to DataFrame for easier handling
-    expr_df = pd.DataFrame(X.T, index=gene_names)
+    if issparse(X):
+        X = csc_matrix(X, dtype=np.float64)
+    else:
+        X = np.asarray(X, dtype=np.float64)
+    gene_names = pd.Index(gene_names)
+    mean, std = column_stats(X)
     
-    # Filter for available TFs and genes
+    # Filter for available TFs and genes, n_genes=0 uses all genes
     available_tfs = [tf for tf in tf_list if tf in gene_names]
-    available_genes = gene_names[:n_genes] if len(gene_names) > n_genes else gene_names
+    available_genes = gene_names[:n_genes] if 0 < n_genes < len(gene_names) else gene_names
     
     print(f"Found {len(available_tfs)} TFs in data")
     print(f"Using {len(available_genes)} genes")
@@ -93,43 +145,52 @@ def compute_correlation_grn(X, gene_names, tf_list, n_genes=1000, corr_threshold
     if len(available_tfs) == 0:
         print("Warning: No TFs found in data, using top expressed genes as TFs")
         # Calculate mean expression and use top genes as TFs
-        mean_expr = expr_df.mean(axis=1).sort_values(ascending=False)
+        mean_expr = pd.Series(mean, index=gene_names).sort_values(ascending=False)
         available_tfs = mean_expr.head(50).index.tolist()
     
-    grn_results = []
+    # Names duplicated in var_names are ambiguous and were skipped by the per
+    # pair pearsonr, so they get no interactions
+    dup = gene_names.duplicated(keep=False)
+    uniq = pd.Series(np.flatnonzero(~dup), index=gene_names[~dup])
+    tf_idx = uniq.reindex(available_tfs)
+    tfs = np.asarray(available_tfs, dtype=object)[tf_idx.notna().values]
+    tf_idx = tf_idx.dropna().values.astype(np.int64)
+    gene_idx = np.flatnonzero(~dup[:len(available_genes)])
+    n = X.shape[0]
     
-    for tf in available_tfs:
-        if tf not in expr_df.index:
-            continue
-            
-        tf_expr = expr_df.loc[tf].values
-        
-        for gene in available_genes:
-            if gene == tf or gene not in expr_df.index:
-                continue
-                
-            gene_expr = expr_df.loc[gene].values
-            
-            # Calculate correlation
-            try:
-                corr, pval = pearsonr(tf_expr, gene_expr)
-                if abs(corr) >= corr_threshold and pval < 0.05:
-                    grn_results.append({
-                        'source': tf,
-                        'target': gene,
-                        'score': abs(corr),
-                        'pval': pval
-                    })
-            except:
-                continue
-    
-    grn_df = pd.DataFrame(grn_results)
+    # Best targets per TF, merged over gene blocks
+    sel_tf, sel_gene, sel_corr, sel_pval = [], [], [], []
+    for start in range(0, gene_idx.size, chunk_size):
+        block = gene_idx[start:start + chunk_size]
+        corr = correlation_block(X, tf_idx, block, mean, std)
+        pval = correlation_pvals(corr, n)
+        msk = (np.abs(corr) >= corr_threshold) & (pval < 0.05) & (tf_idx[:, None] != block[None, :])
+        i, j = np.nonzero(msk)
+        sel_tf.append(i)
+        sel_gene.append(block[j])
+        sel_corr.append(corr[i, j])
+        sel_pval.append(pval[i, j])
+        if top_k > 0:
+            sel_tf, sel_gene, sel_corr, sel_pval = [
+                [a] for a in keep_top_k(*[np.concatenate(a) for a in (sel_tf, sel_gene, sel_corr, sel_pval)], top_k)
+            ]
+    sel_tf, sel_gene, sel_corr, sel_pval = [np.concatenate(a) for a in (sel_tf, sel_gene, sel_corr, sel_pval)]
+    
+    # TF-major, gene ordered interactions
+    order = np.lexsort((sel_gene, sel_tf))
+    grn_df = pd.DataFrame({
+        'source': tfs[sel_tf[order]],
+        'target': gene_names.values[sel_gene[order]],
+        'score': np.abs(sel_corr[order]),
+        'pval': sel_pval[order],
+    })
     
     if len(grn_df) > 0:
         # Sort by score and keep top interactions
         grn_df = grn_df.sort_values('score', ascending=False).head(10000)
     else:
         print("Warning: No significant correlations found, creating minimal output")
+        available_genes = available_genes.tolist()
         # Create minimal output
         grn_df = pd.DataFrame({
             'source': available_tfs[:5] if available_tfs else ['TF1'],
@@ -212,7 +273,7 @@ def main():
     tf_list = get_tf_list()
     
     # Compute GRN
-    grn_df = compute_correlation_grn(X, gene_names, tf_list, args.n_genes, args.corr_threshold)
+    grn_df = compute_correlation_grn(X, gene_names, tf_list, args.n_genes, args.corr_threshold, args.top_k, args.chunk_size)
     
     # Create output directory
     os.makedirs(args.output_dir, exist_ok=True)
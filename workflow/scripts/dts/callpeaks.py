@@ -7,6 +7,9 @@ import pandas as pd
 import numpy as np
 import scipy
 import argparse
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from coords import parse_cres, format_cres
 
 
 # Init args
@@ -83,14 +86,8 @@ if __name__ == '__main__':
     del atac.var
 
     # Update format peaks
-    new_var_names = []
-    for p in atac.var_names:
-        p = p.replace(':', '-')
-        seq, start, end = p.split('-')
-        end = int(end) - 1
-        p = '{0}-{1}-{2}'.format(seq, start, end)
-        new_var_names.append(p)
-    atac.var_names = new_var_names
+    seq, start, end = parse_cres(atac.var_names.values)
+    atac.var_names = format_cres(seq, start, end - 1, sep='-')
 
     # Write
     atac.write(path_output)
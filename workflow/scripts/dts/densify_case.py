@@ -0,0 +1,25 @@
+import mudata as md
+from scipy.sparse import issparse
+import argparse
+
+
+# Init args
+parser = argparse.ArgumentParser()
+parser.add_argument('-i','--path_input', required=True)
+parser.add_argument('-o','--path_output', required=True)
+args = vars(parser.parse_args())
+
+path_input = args['path_input']
+path_output = args['path_output']
+
+# Read
+mdata = md.read_h5mu(path_input)
+
+# Desparsify X of each modality, counts layers stay sparse as in extract_case
+for mod in mdata.mod:
+    if issparse(mdata.mod[mod].X):
+        mdata.mod[mod].X = mdata.mod[mod].X.toarray()
+mdata.update()
+
+# Write
+mdata.write(path_output)
@@ -4,8 +4,12 @@ import snapatac2 as snap
 import scanpy as sc
 import mudata as md
 import scanpy.external as sce
-from scipy.sparse import issparse
+from scipy.sparse import issparse, csr_matrix
 import argparse
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stream import stream_hvg, n_nonzero
 
 
 # Init args
@@ -17,6 +21,9 @@ parser.add_argument('-d','--seed', required=True)
 parser.add_argument('-g','--n_hvg', required=True)
 parser.add_argument('-r','--n_hvr', required=True)
 parser.add_argument('-t','--root', required=True)
+parser.add_argument('-x','--sparse', required=False, default='False')
+parser.add_argument('-k','--chunk_size', required=False, default='0')
+parser.add_argument('-l','--lattice', required=False, default='None')
 parser.add_argument('-o','--path_output', required=True)
 args = vars(parser.parse_args())
 
@@ -27,38 +34,33 @@ seed = int(args['seed'])
 n_hvg = int(args['n_hvg'])
 n_hvr = int(args['n_hvr'])
 root = args['root']
+sparse = args['sparse'] == 'True'
+chunk_size = int(args['chunk_size'])
+lattice = args['lattice']
 path_output = args['path_output']
 
-# Read
-mdata = md.read_h5mu(path_input)
+
+# Read, counts stay on disk when streaming
+mdata = md.read_h5mu(path_input, backed='r' if chunk_size > 0 else None)
+obs = mdata.obs.copy()
 
 # Filter celltypes
 if celltypes != 'all':
     celltypes = celltypes.split(';')
-    mdata = mdata[np.isin(mdata.obs['celltype'], celltypes)].copy()
-mdata.obs['celltype'] = mdata.obs['celltype'].cat.remove_unused_categories()
+    obs = obs[np.isin(obs['celltype'], celltypes)].copy()
+obs['celltype'] = obs['celltype'].cat.remove_unused_categories()
 
 # Downsample
-if n_sample > 0:
-    n_sample = np.min([n_sample, mdata.obs.shape[0]])
-    barcodes = mdata.obs.sample(n=n_sample, random_state=seed, replace=False).index
-    mdata = mdata[barcodes, :].copy()
-
-# Extract
-rna = mdata.mod['rna']
-atac = mdata.mod['atac']
-
-# Make sure enough features
-rna = rna[:, np.sum(rna.X.toarray() != 0., axis=0) > 3].copy()
-atac = atac[:, np.sum(atac.X.toarray() != 0., axis=0) > 3].copy()
-
-# Normalize
-rna.layers['counts'] = rna.X.copy()
-atac.layers['counts'] = atac.X.copy()
-sc.pp.normalize_total(rna, target_sum=1e4)
-sc.pp.log1p(rna)
-sc.pp.normalize_total(atac, target_sum=1e4)
-sc.pp.log1p(atac)
+if lattice != 'None':
+    # Cells sampled from the full object with this seed, resolved over the lattice base
+    barcodes = np.load(lattice)['seed_{0}'.format(seed)]
+    if n_sample > 0:
+        barcodes = barcodes[:n_sample]
+    obs = obs.loc[barcodes]
+elif n_sample > 0:
+    n_sample = np.min([n_sample, obs.shape[0]])
+    obs = obs.loc[obs.sample(n=n_sample, random_state=seed, replace=False).index]
+
 
 # HVG
 def filter_hvg(adata, n_hvg):
@@ -75,16 +77,42 @@ def filter_hvg(adata, n_hvg):
     return hvg.values.astype('U')
 
 
-rna.obs['batch'] = mdata.obs['batch']
-atac.obs['batch'] = mdata.obs['batch']
-hvg = filter_hvg(rna, n_hvg)
-hvr = filter_hvg(atac, n_hvr)
-rna = rna[:, np.isin(rna.var_names.values.astype('U'), hvg)].copy()
-atac = atac[:, np.isin(atac.var_names.values.astype('U'), hvr)].copy()
+if chunk_size > 0:
+    # Select features from row chunks, then load only them
+    rna = stream_hvg(mdata.mod['rna'], obs, n_hvg, chunk_size)
+    atac = stream_hvg(mdata.mod['atac'], obs, n_hvr, chunk_size)
+    mdata = md.MuData({'rna': rna, 'atac': atac})
+    mdata.obs = obs.loc[mdata.obs_names]
+else:
+    mdata = mdata[obs.index, :].copy()
+    mdata.obs['celltype'] = obs['celltype']
+
+    # Extract
+    rna = mdata.mod['rna']
+    atac = mdata.mod['atac']
+
+    # Make sure enough features
+    rna = rna[:, n_nonzero(rna.X, axis=0) > 3].copy()
+    atac = atac[:, n_nonzero(atac.X, axis=0) > 3].copy()
+
+    # Normalize
+    rna.layers['counts'] = rna.X.copy()
+    atac.layers['counts'] = atac.X.copy()
+    sc.pp.normalize_total(rna, target_sum=1e4)
+    sc.pp.log1p(rna)
+    sc.pp.normalize_total(atac, target_sum=1e4)
+    sc.pp.log1p(atac)
+
+    rna.obs['batch'] = mdata.obs['batch']
+    atac.obs['batch'] = mdata.obs['batch']
+    hvg = filter_hvg(rna, n_hvg)
+    hvr = filter_hvg(atac, n_hvr)
+    rna = rna[:, np.isin(rna.var_names.values.astype('U'), hvg)].copy()
+    atac = atac[:, np.isin(atac.var_names.values.astype('U'), hvr)].copy()
 
 # Filter cells and intersect
-rna = rna[(rna.X.A != 0).sum(1) > 3, :].copy()
-atac = atac[(atac.X.A != 0).sum(1) > 3, :].copy()
+rna = rna[n_nonzero(rna.X, axis=1) > 3, :].copy()
+atac = atac[n_nonzero(atac.X, axis=1) > 3, :].copy()
 obs_inter = atac.obs_names.intersection(rna.obs_names)
 rna = rna[obs_inter].copy()
 atac = atac[obs_inter].copy()
@@ -115,11 +143,15 @@ sc.tl.umap(mdata)
 # Clean
 del mdata.obsp
 
-# Desparsify
-if issparse(rna.X):
-    rna.X = rna.X.A
-if issparse(atac.X):
-    atac.X = atac.X.A
+# Desparsify, unless writing a sparse case (see densify_case.py for methods needing dense X)
+if sparse:
+    rna.X = csr_matrix(rna.X)
+    atac.X = csr_matrix(atac.X)
+else:
+    if issparse(rna.X):
+        rna.X = rna.X.A
+    if issparse(atac.X):
+        atac.X = atac.X.A
 
 # Update mdata
 mdata.mod['rna'] = rna
@@ -136,4 +168,7 @@ if root != 'None':
     del mdata.obsp
 
 # Save
-mdata.write(path_output)
+if sparse:
+    mdata.write(path_output, compression='gzip')
+else:
+    mdata.write(path_output)
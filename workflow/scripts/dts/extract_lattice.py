@@ -0,0 +1,56 @@
+import numpy as np
+import mudata as md
+from scipy.sparse import csr_matrix
+import argparse
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stream import n_nonzero
+
+
+# Init args
+parser = argparse.ArgumentParser()
+parser.add_argument('-i','--path_input', required=True)
+parser.add_argument('-s','--n_sample', required=True)
+parser.add_argument('-d','--seeds', required=True)
+parser.add_argument('-o','--path_base', required=True)
+parser.add_argument('-x','--path_idx', required=True)
+args = vars(parser.parse_args())
+
+path_input = args['path_input']
+n_sample = int(args['n_sample'])
+seeds = [int(s) for s in args['seeds'].split(';')]
+path_base = args['path_base']
+path_idx = args['path_idx']
+
+# Read
+mdata = md.read_h5mu(path_input)
+mdata.obs['celltype'] = mdata.obs['celltype'].cat.remove_unused_categories()
+
+# Largest sample of each seed, smaller ones are its prefixes as in extract_case
+n_sample = np.min([n_sample, mdata.obs.shape[0]])
+idx = dict()
+for seed in seeds:
+    barcodes = mdata.obs.sample(n=n_sample, random_state=seed, replace=False).index
+    idx['seed_{0}'.format(seed)] = barcodes.values.astype('U')
+
+# Base holds the union of sampled cells
+cells = mdata.obs_names[mdata.obs_names.isin(np.concatenate(list(idx.values())))]
+mdata = mdata[cells, :].copy()
+
+# Features too sparse for any case
+rna = mdata.mod['rna']
+atac = mdata.mod['atac']
+rna = rna[:, n_nonzero(rna.X, axis=0) > 3].copy()
+atac = atac[:, n_nonzero(atac.X, axis=0) > 3].copy()
+rna.X = csr_matrix(rna.X)
+atac.X = csr_matrix(atac.X)
+mdata.mod['rna'] = rna
+mdata.mod['atac'] = atac
+mdata.update()
+
+# Write
+mdata.write(path_base, compression='gzip')
+tmp_path = '{0}.{1}.tmp.npz'.format(path_idx, os.getpid())
+np.savez(tmp_path, **idx)
+os.replace(tmp_path, path_idx)
@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+import anndata as ad
+from scipy.sparse import issparse, csr_matrix, vstack
+
+
+def n_nonzero(X, axis):
+    """Number of non-zero values per column (axis=0) or row (axis=1), without densifying"""
+    if issparse(X):
+        X = X.tocsc() if axis == 0 else X.tocsr()
+        X.eliminate_zeros()
+        return np.diff(X.indptr)
+    return np.sum(X != 0., axis=axis)
+
+
+def iter_chunks(adata, rows, chunk_size, cols=None):
+    """Yield (positions, csr) of the given rows of a backed modality, reading
+    contiguous blocks of chunk_size rows from disk"""
+    order = np.argsort(rows, kind='stable')
+    s_rows = rows[order]
+    for start in range(0, adata.n_obs, chunk_size):
+        i, j = np.searchsorted(s_rows, [start, start + chunk_size])
+        if i == j:
+            continue
+        X = adata.X[start:start + chunk_size]
+        X = csr_matrix(X) if not issparse(X) else X.tocsr()
+        X = X[s_rows[i:j] - start]
+        if cols is not None:
+            X = X[:, cols]
+        yield order[i:j], X
+
+
+class BatchStats:
+    """Running per feature mean, M2 and nnz of a batch, merged chunk by chunk (Chan et al.)"""
+    def __init__(self, n_vars):
+        self.n = 0
+        self.mean = np.zeros(n_vars)
+        self.m2 = np.zeros(n_vars)
+        self.nnz = np.zeros(n_vars, dtype=np.int64)
+
+    def update(self, X):
+        n_c = X.shape[0]
+        mean_c = np.asarray(X.sum(0)).ravel() / n_c
+        m2_c = np.asarray(X.multiply(X).sum(0)).ravel() - n_c * mean_c ** 2
+        n = self.n + n_c
+        delta = mean_c - self.mean
+        self.mean += delta * n_c / n
+        self.m2 += m2_c + delta ** 2 * self.n * n_c / n
+        self.nnz += X.getnnz(0)
+        self.n = n
+
+    @property
+    def var(self):
+        # Unbiased, as scanpy does
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.m2 / (self.n - 1)
+
+
+def seurat_hvg(mean, var, n_bins=20, min_mean=0.0125, max_mean=3, min_disp=0.5, max_disp=np.inf):
+    """Highly variable features of a batch from its mean and variance, as
+    sc.pp.highly_variable_genes(flavor='seurat') does on expm1 of the data"""
+    mean = mean.copy()
+    mean[mean == 0] = 1e-12
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dispersion = var / mean
+        dispersion[dispersion == 0] = np.nan
+        dispersion = np.log(dispersion)
+    mean = np.log1p(mean)
+    df = pd.DataFrame({'means': mean, 'dispersions': dispersion})
+    df['mean_bin'] = pd.cut(df['means'], bins=n_bins)
+    disp_grouped = df.groupby('mean_bin', observed=False)['dispersions']
+    disp_mean_bin = disp_grouped.mean()
+    disp_std_bin = disp_grouped.std(ddof=1)
+    one_gene_per_bin = disp_std_bin.isnull()
+    disp_std_bin[one_gene_per_bin.values] = disp_mean_bin[one_gene_per_bin.values].values
+    disp_mean_bin[one_gene_per_bin.values] = 0
+    disp_norm = (
+        df['dispersions'].values - disp_mean_bin[df['mean_bin'].values].values
+    ) / disp_std_bin[df['mean_bin'].values].values
+    disp_norm[np.isnan(disp_norm)] = 0
+    return (mean > min_mean) & (mean < max_mean) & (disp_norm > min_disp) & (disp_norm < max_disp)
+
+
+def stream_hvg(adata, obs, n_hvg, chunk_size, target_sum=1e4):
+    """Feature filter, normalize_total/log1p and batch aware HVG selection of
+    extract_case, computed from row chunks of a backed modality. Only the
+    selected cells and features are loaded into memory"""
+    rows = adata.obs_names.get_indexer(obs.index)
+    batches = pd.Categorical(obs['batch'].values)
+    codes = batches.codes
+
+    # Features with enough cells
+    nnz = np.zeros(adata.n_vars, dtype=np.int64)
+    for _, X in iter_chunks(adata, rows, chunk_size):
+        X.eliminate_zeros()
+        nnz += X.getnnz(0)
+    feats = np.flatnonzero(nnz > 3)
+
+    # Library sizes and per batch stats of normalized data
+    totals = np.zeros(rows.size)
+    stats = [BatchStats(feats.size) for _ in batches.categories]
+    for pos, X in iter_chunks(adata, rows, chunk_size, cols=feats):
+        X = X.astype(np.float64)
+        total = np.asarray(X.sum(1)).ravel()
+        totals[pos] = total
+        X = csr_matrix(X.multiply((target_sum / np.where(total == 0, 1, total))[:, None]))
+        for b in np.unique(codes[pos]):
+            stats[b].update(X[codes[pos] == b])
+
+    # Count in how many batches each feature is highly variable
+    n_batches = np.zeros(feats.size, dtype=np.int64)
+    for s in stats:
+        if s.n == 0:
+            continue
+        filt = s.nnz > 0
+        n_batches[filt] += seurat_hvg(s.mean[filt], s.var[filt])
+    var_names = adata.var_names[feats]
+    hvg = pd.DataFrame({'highly_variable_nbatches': n_batches}, index=var_names)
+    hvg = hvg.sort_values('highly_variable_nbatches', ascending=False).head(n_hvg).index
+    cols = feats[np.isin(var_names.values.astype('U'), hvg.values.astype('U'))]
+
+    # Load selected cells and features
+    chunks = list(iter_chunks(adata, rows, chunk_size, cols=cols))
+    pos = np.concatenate([p for p, _ in chunks])
+    X = vstack([x for _, x in chunks]).tocsr()[np.argsort(pos)]
+    sub = ad.AnnData(
+        X=X.astype(np.float32),
+        obs=adata.obs.iloc[rows].copy(),
+        var=adata.var.iloc[cols].copy(),
+    )
+    sub.layers['counts'] = sub.X.copy()
+    scale = (target_sum / np.where(totals == 0, 1, totals))[:, None]
+    sub.X = csr_matrix(sub.X.multiply(scale), dtype=np.float32)
+    sub.X.data = np.log1p(sub.X.data)
+    return sub
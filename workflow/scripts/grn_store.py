@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import tempfile
+import json
+import os
+
+
+# Parquet metadata key holding the size and mtime of the csv a store partition shadows
+CSV_KEY = b'grn_csv'
+
+
+def get_store_path(grn_path):
+    """Partition of a grn inside its case store (dts/{dat}/cases/{case}/grns),
+    None if its name is not a pre.p2g.tfb.mdl combination"""
+    case_path = os.path.dirname(os.path.dirname(os.path.abspath(grn_path)))
+    name = os.path.basename(grn_path).replace('.grn.csv', '').replace('.csv', '')
+    steps = name.split('.')
+    if len(steps) != 4:
+        return None
+    pre, p2g, tfb, mdl = steps
+    part_path = os.path.join(
+        case_path, 'grns',
+        f'pre={pre}', f'p2g={p2g}', f'tfb={tfb}', f'mdl={mdl}',
+        'part-0.parquet'
+    )
+    return part_path
+
+
+def get_csv_stamp(grn_path):
+    """Size and mtime of the grn csv, changes whenever the csv is rewritten"""
+    st = os.stat(grn_path)
+    return dict(size=st.st_size, mtime_ns=st.st_mtime_ns)
+
+
+def write_grn_store(grn, grn_path):
+    """Write grn into the case store, dictionary-encoding string columns.
+    Values are stored as read back from the csv: missing strings as nulls
+    and floats as float64 parsed from their csv text. Must be called after
+    the csv at grn_path is written, its stamp is kept in the partition"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        print('pyarrow not available, skipping grn store')
+        return None
+    part_path = get_store_path(grn_path)
+    if part_path is None:
+        return None
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    str_cols = [c for c in ['source', 'cre', 'target'] if c in grn.columns]
+    flt_cols = [c for c in grn.columns if pd.api.types.is_float_dtype(grn[c]) and grn[c].dtype != np.float64]
+    cols = dict()
+    for col in grn.columns:
+        vals = grn[col]
+        if col in str_cols:
+            msk = vals.notna().values
+            cols[col] = pa.array(np.where(msk, vals.astype(str).values, None), type=pa.string())
+        elif col in flt_cols:
+            cols[col] = pa.array(vals.astype(str).astype(np.float64).values)
+        else:
+            cols[col] = pa.array(vals.values)
+    table = pa.table(cols)
+    table = table.replace_schema_metadata({CSV_KEY: json.dumps(get_csv_stamp(grn_path)).encode()})
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(part_path) + '.', suffix='.tmp', dir=os.path.dirname(part_path))
+    os.close(fd)
+    pq.write_table(table, tmp_path, use_dictionary=str_cols, compression='zstd')
+    os.replace(tmp_path, part_path)
+    return part_path
+
+
+def read_grn_store(grn_path, columns=None, filters=None):
+    """Read a grn from its case store, None if there is no partition or it
+    was not written from the current csv at grn_path"""
+    part_path = get_store_path(grn_path)
+    if part_path is None or not os.path.isfile(part_path):
+        return None
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        return None
+    schema = pq.read_schema(part_path)
+    stamp = (schema.metadata or dict()).get(CSV_KEY)
+    if stamp is None or json.loads(stamp) != get_csv_stamp(grn_path):
+        return None
+    if columns is not None:
+        columns = [c for c in columns if c in schema.names]
+    grn = pq.read_table(part_path, columns=columns, filters=filters, memory_map=True)
+    grn = grn.to_pandas()
+    for col in grn.columns:
+        if isinstance(grn[col].dtype, pd.CategoricalDtype):
+            grn[col] = grn[col].astype(object)
+        if grn[col].dtype == object:
+            grn[col] = grn[col].where(grn[col].notna(), np.nan)
+    return grn
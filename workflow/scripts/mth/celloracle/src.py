@@ -8,6 +8,9 @@ import os
 import argparse
 from genomepy import Genome, install_genome, config
 from gimmemotifs.motif import default_motifs
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from coords import parse_cres
 
 
 # Init args
@@ -76,19 +79,6 @@ if __name__ == '__main__':
     # Load annotated peak data.
     p2g['cre'] = p2g['cre'].str.replace('-', '_')
     
-    def decompose_chrstr(peak_str):
-        """
-        Args:
-            peak_str (str): peak_str. e.g. 'chr1_3094484_3095479'
-    
-        Returns:
-            tuple: chromosome name, start position, end position
-        """
-    
-        *chr_, start, end = peak_str.split("_")
-        chr_ = "_".join(chr_)
-        return chr_, start, end
-    
     def check_peak_format(peaks_df, gname, gdir):
         """
         Check peak format.
@@ -102,11 +92,8 @@ if __name__ == '__main__':
         n_peaks_before = df.shape[0]
     
         # Decompose peaks and make df
-        decomposed = [decompose_chrstr(peak_str) for peak_str in df["peak_id"]]
-        df_decomposed = pd.DataFrame(np.array(decomposed), index=peaks_df.index)
-        df_decomposed.columns = ["chr", "start", "end"]
-        df_decomposed["start"] = df_decomposed["start"].astype(int)
-        df_decomposed["end"] = df_decomposed["end"].astype(int)
+        chr_, start, end = parse_cres(df["peak_id"].values)
+        df_decomposed = pd.DataFrame({"chr": np.asarray(chr_), "start": start, "end": end}, index=peaks_df.index)
     
         # Load genome data
         genome_data = Genome(gname, genomes_dir=gdir)
@@ -1,15 +1,22 @@
 import pandas as pd
+import numpy as np
+import tempfile
 import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from grn_store import write_grn_store
 import argparse
 
 # Init args
 parser = argparse.ArgumentParser()
 parser.add_argument('-i', '--path_input', required=True)
 parser.add_argument('-o', '--path_out', required=True)
+parser.add_argument('-p', '--n_parts', required=False, default='0')
 args = vars(parser.parse_args())
 
 mdl_path = args['path_input']
 path_out = args['path_out']
+n_parts = int(args['n_parts'])
 
 # Find paths
 path = os.path.dirname(mdl_path)
@@ -26,6 +33,7 @@ mdl = pd.concat(mdl_chunks, ignore_index=True)
 if mdl.empty:
     grn = pd.DataFrame(columns=['source', 'cre', 'target', 'score', 'pval'])
     grn.to_csv(path_out, index=False)
+    write_grn_store(grn, path_out)
     os._exit(0)
 
 # Limit to 100k largest absolute scores
@@ -37,6 +45,7 @@ gns = set(mdl['target'].unique())
 baselines = {'collectri', 'dorothea', 'random', 'scenic'}
 if lst[0] in baselines or lst[0].startswith('o_'):
     mdl.to_csv(path_out, index=False)
+    write_grn_store(mdl, path_out)
     os._exit(0)
 
 # Read paths
@@ -44,21 +53,72 @@ pre_name, p2g_name, tfb_name, mdl_name = lst
 p2g_path = os.path.join(path, f'{pre_name}.{p2g_name}.p2g.csv')
 tfb_path = os.path.join(path, f'{pre_name}.{p2g_name}.{tfb_name}.tfb.csv')
 
-# Read relevant columns with filtering
-usecols_tfb = ['tf', 'cre']
-usecols_p2g = ['cre', 'gene']
+# Encode kept tf-gene pairs as integer keys
+tf_idx = pd.Index(sorted(tfs))
+gn_idx = pd.Index(sorted(gns))
+mdl['key'] = tf_idx.get_indexer(mdl['source']).astype(np.int64) * gn_idx.size + gn_idx.get_indexer(mdl['target'])
+mdl = mdl[['key', 'score', 'pval']]
 
-tfb_chunks = pd.read_csv(tfb_path, usecols=usecols_tfb, dtype={'tf': 'category', 'cre': 'category'}, chunksize=chunksize)
-tfb = pd.concat((chunk[chunk['tf'].isin(tfs)] for chunk in tfb_chunks), ignore_index=True)
 
-p2g_chunks = pd.read_csv(p2g_path, usecols=usecols_p2g, dtype={'cre': 'category', 'gene': 'category'}, chunksize=chunksize)
-p2g = pd.concat((chunk[chunk['gene'].isin(gns)] for chunk in p2g_chunks), ignore_index=True)
+def spill(csv_path, col, index, parts_path):
+    """Stream a tfb or p2g csv, keep rows whose col is in index and append
+    (col code, cre hash, cre) arrays to one file per cre partition"""
+    files = [open(parts_path.format(i), 'wb') for i in range(n_parts)]
+    for chunk in pd.read_csv(csv_path, usecols=[col, 'cre'], dtype=str, chunksize=chunksize):
+        codes = index.get_indexer(chunk[col])
+        msk = codes >= 0
+        cres = chunk['cre'].values[msk].astype('U')
+        codes = codes[msk]
+        hashes = pd.util.hash_array(cres)
+        part = hashes % n_parts
+        for i in np.unique(part):
+            m = part == i
+            np.save(files[i], codes[m])
+            np.save(files[i], hashes[m])
+            np.save(files[i], cres[m])
+    for f in files:
+        f.close()
 
-# Merge in an optimized manner
-grn = tfb.merge(p2g, on='cre', how='inner')
-grn = grn.rename(columns={'tf': 'source', 'gene': 'target'})
-grn = grn.merge(mdl, on=['source', 'target'], how='inner')
+
+def read_part(path):
+    """Concatenate the arrays appended to a partition file"""
+    codes, hashes, cres = [], [], []
+    with open(path, 'rb') as f:
+        while f.peek(1):
+            codes.append(np.load(f))
+            hashes.append(np.load(f))
+            cres.append(np.load(f))
+    if len(codes) == 0:
+        return pd.DataFrame({'code': np.array([], dtype=np.int64), 'hash': np.array([], dtype=np.uint64), 'cre': np.array([], dtype='U')})
+    return pd.DataFrame({'code': np.concatenate(codes), 'hash': np.concatenate(hashes), 'cre': np.concatenate(cres)})
+
+
+# Partition tfb and p2g by cre, bounded memory per partition
+if n_parts < 1:
+    n_parts = max(1, int(np.ceil(os.path.getsize(tfb_path) / 2 ** 28)))
+grn = []
+with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path_out))) as tmp_dir:
+    tfb_parts = os.path.join(tmp_dir, 'tfb.{0}.npy')
+    p2g_parts = os.path.join(tmp_dir, 'p2g.{0}.npy')
+    spill(tfb_path, 'tf', tf_idx, tfb_parts)
+    spill(p2g_path, 'gene', gn_idx, p2g_parts)
+
+    # Join each partition, emitting only triplets with a kept tf-gene pair
+    for i in range(n_parts):
+        tfb = read_part(tfb_parts.format(i))
+        p2g = read_part(p2g_parts.format(i))
+        # The hash only picks the partition, cres are matched on their name
+        part = tfb.merge(p2g, on=['hash', 'cre'], how='inner', suffixes=('_tf', '_gn'))
+        part['key'] = part['code_tf'].astype(np.int64) * gn_idx.size + part['code_gn']
+        part = part[['key', 'cre']].merge(mdl, on='key', how='inner')
+        grn.append(part)
+grn = pd.concat(grn, ignore_index=True)
+
+# Decode pairs
+grn['source'] = tf_idx.values[grn['key'].values // gn_idx.size]
+grn['target'] = gn_idx.values[grn['key'].values % gn_idx.size]
 grn = grn.sort_values(['source', 'target', 'cre']).reset_index(drop=True)
 grn = grn[['source', 'cre', 'target', 'score', 'pval']]
 
 grn.to_csv(path_out, index=False)
+write_grn_store(grn, path_out)
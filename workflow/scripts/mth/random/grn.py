@@ -2,8 +2,13 @@ import mudata as mu
 import numpy as np
 import pandas as pd
 import pyranges as pr
+from natsort import index_natsorted
 from tqdm import tqdm
 import argparse
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from coords import parse_cres, format_cres
 
 
 # Init args
@@ -56,41 +61,59 @@ def run_pre(mdata, seed):
     return mdata
 
 
-def get_window(gannot, target, w_size):
-    target_gr = gannot[gannot.df['Name'] == target]
-    tss = target_gr.df['Start'].values[0] + 1000  # Assumes window of 1000+/-
-    tss_window = pr.from_dict({
-        "Chromosome": target_gr.Chromosome,
-        "Start": tss - w_size,
-        "End": tss + w_size,
-    })
-    return tss_window
-
-
-def get_cres_pr(mdata):
-    cres = [c.split('-') for c in mdata.mod['atac'].var_names.values.astype('U')]
-    cres = pr.PyRanges(pd.DataFrame(cres, columns=['Chromosome', 'Start', 'End']))
-    return cres
-
-
-def get_overlap_cres(gene, cres, w_size):
-    wnd = get_window(gannot, target=gene, w_size=w_size)
-    o_cres = cres.overlap(wnd)
-    if len(o_cres) > 0:
-        o_cres = (
-            o_cres.df
-            .assign(name=lambda x: x['Chromosome'].astype(str) + '-' + x['Start'].astype(str) + '-' + x['End'].astype(str))
-            ['name'].values
-        )
-        return o_cres
+def get_tss(gannot):
+    """Tss windows of the annotation, one per gene and chromosome (e.g. PAR
+    genes get one on chrX and one on chrY), all at the tss of the first entry
+    of the gene. Sorted by gene and natural chromosome order, as pyranges
+    returns overlaps"""
+    df = gannot.df[['Chromosome', 'Start', 'Name']].astype({'Chromosome': str, 'Name': str})
+    df['tss'] = df.groupby('Name', sort=False)['Start'].transform('first') + 1000  # Assumes window of 1000+/-
+    df = df.drop_duplicates(['Name', 'Chromosome'])
+    df = df.iloc[index_natsorted(df['Chromosome'])]
+    df = df.sort_values('Name', kind='stable').reset_index(drop=True)
+    return df[['Name', 'Chromosome', 'tss']]
+
+
+def get_cres_idx(mdata):
+    """Cres sorted by chromosome and start, with per chromosome offsets"""
+    chrom, start, end = parse_cres(mdata.mod['atac'].var_names.values)
+    order = np.lexsort((start, chrom.codes))
+    bounds = np.searchsorted(chrom.codes[order], np.arange(chrom.categories.size + 1))
+    offsets = {c: (bounds[i], bounds[i + 1]) for i, c in enumerate(np.asarray(chrom.categories).astype('U'))}
+    names = format_cres(chrom, start, end, sep='-')
+    return dict(order=order, start=start[order], end=end[order], names=names, offsets=offsets)
+
+
+def get_overlap_cres(genes, tss, cres, w_size):
+    """Cres overlapping the tss windows of each gene, in var order per chromosome as pyranges returns them"""
+    max_len = np.max(cres['end'] - cres['start']) if cres['order'].size > 0 else 0
+    g_idx = pd.Index(genes).get_indexer(tss['Name'].values)
+    wnd = tss.loc[g_idx >= 0]
+    w_gene = g_idx[g_idx >= 0]
+    w_chr = wnd['Chromosome'].values.astype('U')
+    w_tss = wnd['tss'].values.astype(np.int64)
+    lo = np.zeros(w_gene.size, dtype=np.int64)
+    hi = np.zeros(w_gene.size, dtype=np.int64)
+    for c, (i, j) in cres['offsets'].items():
+        msk = w_chr == c
+        starts = cres['start'][i:j]
+        # Overlap if cre start < window end and cre end > window start, windows may start below 0
+        lo[msk] = i + np.searchsorted(starts, w_tss[msk] - w_size - max_len, side='right')
+        hi[msk] = i + np.searchsorted(starts, w_tss[msk] + w_size, side='left')
+    o_cres = [[] for _ in range(genes.size)]
+    for k in range(w_gene.size):
+        idx = np.arange(lo[k], hi[k])
+        idx = idx[cres['end'][idx] > w_tss[k] - w_size]
+        o_cres[w_gene[k]].append(cres['names'][np.sort(cres['order'][idx])])
+    return [np.concatenate(o) if len(o) > 0 else np.array([], dtype='U') for o in o_cres]
 
 
 def run_p2g(mdata, gannot, g_perc, scale, w_size, seed):
     # Read features
     genes = mdata.mod['rna'].var_names.values.astype('U')
-    cres = get_cres_pr(mdata)
-    g_in_ann = list(set(gannot.df['Name'].values))
-    genes = genes[np.isin(genes, g_in_ann)]
+    cres = get_cres_idx(mdata)
+    tss = get_tss(gannot)
+    genes = genes[np.isin(genes, tss['Name'].values)]
     print(genes.size)
     
     # Randomly sample genes
@@ -100,13 +123,13 @@ def run_p2g(mdata, gannot, g_perc, scale, w_size, seed):
     n_cres = np.ceil(rng.exponential(scale=scale, size=genes.size))
     
     # Randomly sample peak-gene connections
+    o_cres = get_overlap_cres(genes, tss, cres, w_size)
     df = []
     for i in tqdm(range(genes.size)):
         n_cre = int(n_cres[i])
         g = genes[i]
-        o_cres = get_overlap_cres(g, cres, w_size)
-        if o_cres is not None:
-            r_cres = rng.choice(o_cres, np.min([n_cre, o_cres.size]), replace=False)
+        if o_cres[i].size > 0:
+            r_cres = rng.choice(o_cres[i], np.min([n_cre, o_cres[i].size]), replace=False)
             for cre in r_cres:
                 df.append([cre, g, 1])
     df = pd.DataFrame(df, columns=['cre', 'gene', 'score'])
@@ -7,13 +7,13 @@ import pandas as pd
 import pyranges as pr
 import anndata as ad
 import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from coords import cres_to_df
 
 
 def get_pr(index):
-    df = index.str.replace(':', '-') 
-    df = df.str.split('-').tolist()
-    df = pd.DataFrame(df, columns=['Chromosome', 'Start', 'End'])
-    return pr.PyRanges(df)
+    return pr.PyRanges(cres_to_df(index.values))
 
 
 def get_motifs_for_TF(tf_names, annotation_to_use, motif_to_tf):
@@ -5,19 +5,16 @@ import h5py
 import pandas as pd
 import mudata as mu
 import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from coords import cres_to_df, format_cres, convert_cres
 
 def get_pr(index):
-    df = index.str.replace(':', '-') 
-    df = df.str.split('-').tolist()
-    df = pd.DataFrame(df, columns=['Chromosome', 'Start', 'End'])
-    return pr.PyRanges(df)
+    return pr.PyRanges(cres_to_df(index.values))
 
 
 def get_vars(df):
-    chrm = df.df['Chromosome'].astype(str)
-    strt = df.df['Start'].astype(str)
-    end = df.df['End'].astype(str)
-    return pd.Index(chrm + ':' + strt + '-' + end)
+    return pd.Index(format_cres(df.df['Chromosome'], df.df['Start'], df.df['End'], sep=':'))
 
 
 path_pre = sys.argv[1]
@@ -60,7 +57,7 @@ tfb = pd.DataFrame()
 tfb['cre'] = new_motifs.obs_names[new_motifs.X.row]
 tfb['tf'] = new_motifs.var_names[new_motifs.X.col]
 tfb['score'] = 5.
-tfb['cre'] = tfb['cre'].str.replace(':', '-')
+tfb['cre'] = convert_cres(tfb['cre'].values, sep='-')
 
 # Write
 tfb.to_csv(path_out, index=False)
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import resource
+import json
+import time
+import os
+from contextlib import contextmanager
+
+
+# Columns of snakemake benchmark files kept by read_benchmark
+BENCH_COLS = ['s', 'cpu_time', 'max_rss', 'max_uss', 'io_in', 'io_out', 'mean_load']
+
+
+def read_benchmark(path):
+    """Wall time (s), cpu time (s), peak memory (MB) and io (MB) of a job from
+    its snakemake benchmark tsv, last repeat if it was benchmarked several times.
+    All NaN if the job has no benchmark (e.g. it ran before it was benchmarked)"""
+    if not os.path.isfile(path):
+        return {col: np.nan for col in BENCH_COLS}
+    df = pd.read_csv(path, sep='\t')
+    row = df.iloc[-1].reindex(BENCH_COLS)
+    return pd.to_numeric(row, errors='coerce').to_dict()
+
+
+def get_usage():
+    """Cpu time (s), peak rss (MB) and io bytes of this process and its waited
+    children. Workers of a process pool are only counted once the pool has shut
+    down and reaped them, /proc/self/io then includes their io too"""
+    slf = resource.getrusage(resource.RUSAGE_SELF)
+    chd = resource.getrusage(resource.RUSAGE_CHILDREN)
+    usage = dict(
+        cpu=slf.ru_utime + slf.ru_stime + chd.ru_utime + chd.ru_stime,
+        rss=max(slf.ru_maxrss, chd.ru_maxrss) / 1024,
+        io_in=np.nan,
+        io_out=np.nan,
+    )
+    # Only available on linux
+    if os.path.isfile('/proc/self/io'):
+        with open('/proc/self/io') as f:
+            io = dict(line.split(': ') for line in f.read().splitlines())
+        usage['io_in'] = int(io['read_bytes'])
+        usage['io_out'] = int(io['write_bytes'])
+    return usage
+
+
+class Telemetry:
+    """Recorder of the wall time, cpu time, peak rss, io bytes and phase timings
+    of a script run. On write, appends one json line keyed by rule and wildcards
+    to path, nothing is written if path is None"""
+
+    def __init__(self, rule, wildcards=None, path=None):
+        self.path = path
+        self.rule = rule
+        self.wildcards = dict() if wildcards is None else dict(wildcards)
+        self.phases = dict()
+        self.start = time.perf_counter()
+        self.usage = get_usage()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.) + time.perf_counter() - start
+
+    def write(self):
+        if self.path is None:
+            return None
+        usage = get_usage()
+        rec = dict(
+            rule=self.rule,
+            wildcards=self.wildcards,
+            time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+            wall=time.perf_counter() - self.start,
+            cpu=usage['cpu'] - self.usage['cpu'],
+            rss=usage['rss'],
+            io_in=usage['io_in'] - self.usage['io_in'],
+            io_out=usage['io_out'] - self.usage['io_out'],
+            phases=self.phases,
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # A single appended line per run, so concurrent jobs do not interleave
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(rec) + '\n')
+        return rec